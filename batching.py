@@ -0,0 +1,145 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    """Collects items per key and hands each group to `flush` in one call.
+
+    A group goes out `window` seconds after its first item arrived, or at
+    once when it reaches `max_items`. Items of the same key arriving while
+    an earlier group is being flushed start a new group. A `window` of 0
+    flushes every item on its own.
+    """
+
+    def __init__(self, flush: Callable[[Hashable, List[Any]], Awaitable[None]], window: float,
+                 max_items: int = 100):
+        self.flush = flush
+        self.window = window
+        self.max_items = max(1, max_items)
+        self.batches = 0
+        self.items = 0
+        self._groups: Dict[Hashable, List[Any]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self):
+        """Items waiting for their group to be flushed."""
+        return sum(len(group) for group in self._groups.values())
+
+    def add(self, key: Hashable, item: Any):
+        group = self._groups.setdefault(key, [])
+        group.append(item)
+        if len(group) >= self.max_items or self.window <= 0:
+            self._flush(key)
+        elif len(group) == 1:
+            self._timers[key] = asyncio.get_event_loop().call_later(self.window, self._flush, key)
+
+    def keys(self) -> List[Hashable]:
+        """Keys with items waiting."""
+        return list(self._groups)
+
+    async def flush_now(self, key: Hashable):
+        """Flush the group of `key` without waiting for its window, and wait for that flush."""
+        task = self._flush(key)
+        if task is not None:
+            await task
+
+    def _flush(self, key: Hashable) -> Optional[asyncio.Task]:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._groups.pop(key, None)
+        if not items:
+            return None
+        self.batches += 1
+        self.items += len(items)
+        task = asyncio.ensure_future(self._run(key, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, key: Hashable, items: List[Any]):
+        try:
+            await self.flush(key, items)
+        except Exception as e:
+            logger.error(f"Error flushing {len(items)} item(s) of {key}: {e}")
+
+    async def drain(self):
+        """Flush every group now and wait for all flushes to finish."""
+        for key in list(self._groups):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class CompletionGroups:
+    """Holds items per group until every expected key of the group finished.
+
+    `expect(group, keys)` opens a group. Items `add`ed to it are held until
+    `finish` was called for each of its keys, or until `deadline` seconds
+    after it opened, and are then handed to `publish(group, items)` in one
+    call. A group is published once; `add` returns False for a group that
+    is not open, so the caller can handle the item on its own.
+    """
+
+    def __init__(self, publish: Callable[[Hashable, List[Any]], Awaitable[None]], deadline: float):
+        self.publish = publish
+        self.deadline = deadline
+        self.published = 0
+        self._expected: Dict[Hashable, Set[Hashable]] = {}
+        self._items: Dict[Hashable, List[Any]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self):
+        """Groups still open."""
+        return len(self._expected)
+
+    def __contains__(self, group: Hashable) -> bool:
+        return group in self._expected
+
+    def expect(self, group: Hashable, keys: Iterable[Hashable]):
+        if group not in self._expected:
+            self._expected[group] = set()
+            self._items[group] = []
+            self._timers[group] = asyncio.get_event_loop().call_later(self.deadline, self._publish, group, True)
+        self._expected[group].update(keys)
+
+    def add(self, group: Hashable, item: Any) -> bool:
+        items = self._items.get(group)
+        if items is None:
+            return False
+        items.append(item)
+        return True
+
+    def finish(self, group: Hashable, key: Hashable):
+        expected = self._expected.get(group)
+        if expected is None:
+            return
+        expected.discard(key)
+        if not expected:
+            self._publish(group)
+
+    def _publish(self, group: Hashable, timed_out: bool = False):
+        timer = self._timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        missing = self._expected.pop(group, ())
+        items = self._items.pop(group, [])
+        if timed_out and missing:
+            logger.warning(f"Publishing {group} after {self.deadline:.0f}s without {len(missing)} key(s)")
+        if not items:
+            return
+        self.published += 1
+        task = asyncio.ensure_future(self._run(group, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, group: Hashable, items: List[Any]):
+        try:
+            await self.publish(group, items)
+        except Exception as e:
+            logger.error(f"Error publishing {len(items)} item(s) of {group}: {e}")
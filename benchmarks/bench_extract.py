@@ -0,0 +1,62 @@
+"""Link extraction over a corpus of channel captions.
+
+Compares the old per-call inline regex over raw text with the shared
+LinkExtractor, both through its regex and through message entities.
+
+Usage: python benchmarks/bench_extract.py [rounds]
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.extensions import markdown  # noqa: E402
+from telethon.helpers import add_surrogate  # noqa: E402
+from telethon.tl.types import Message, MessageEntityUrl, PeerChannel  # noqa: E402
+
+from links import LinkExtractor  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "captions.txt")
+OLD_PATTERN = r'(?:https?://(?:www\.)?(?:1024terabox\.com|terabox\.com|teraboxlink\.com|terafileshare\.com|teraboxshare\.com|teraboxapp\.com|terasharelink\.com)/\S+)'
+URL_RE = re.compile(r"https?://\S+")
+
+
+def load_messages():
+    """Captions as Telethon messages with the URL entities Telegram would attach."""
+    with open(CORPUS, encoding="utf-8") as f:
+        captions = [c.strip("\n") for c in f.read().split("\n---\n")]
+    messages = []
+    for i, caption in enumerate(captions, 1):
+        text, entities = markdown.parse(caption)
+        # Offsets are in UTF-16 code units, which add_surrogate gives us
+        for match in URL_RE.finditer(add_surrogate(text)):
+            entities.append(MessageEntityUrl(match.start(), match.end() - match.start()))
+        entities.sort(key=lambda e: e.offset)
+        messages.append(Message(id=i, peer_id=PeerChannel(1), message=text, entities=entities))
+    return messages
+
+
+def old_extract(message):
+    return [m.group(0) for m in re.finditer(OLD_PATTERN, message.raw_text)]
+
+
+def main(rounds: int):
+    messages = load_messages()
+    extractor = LinkExtractor()
+    cases = [
+        ("inline regex (old)", old_extract),
+        ("compiled regex", lambda m: extractor.extract_text(m.raw_text)),
+        ("entities", extractor.extract),
+    ]
+    print(f"{len(messages)} captions, {rounds} rounds")
+    print(f"{'extractor':<20} {'us/caption':>11} {'links':>6}")
+    for name, func in cases:
+        seconds = timeit.timeit(lambda: [func(m) for m in messages], number=rounds)
+        links = sum(len(func(m)) for m in messages)
+        print(f"{name:<20} {seconds / rounds / len(messages) * 1e6:>11.2f} {links:>6}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
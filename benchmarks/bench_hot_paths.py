@@ -0,0 +1,282 @@
+"""Per-call cost of the functions every message and link goes through.
+
+Covers link extraction, the media filter, correlation lookups at several
+index sizes, queue round trips and thumbnail handling, all on synthetic
+Telethon objects. Each case is timed in batches until a batch takes at
+least --min-time seconds; the best of --repeat batches is reported.
+
+--save writes the results as JSON; --baseline compares against such a file
+and exits with status 1 when a case got slower by more than --threshold
+(a fraction, 0.25 = 25%).
+
+Usage: python benchmarks/bench_hot_paths.py [--json] [--save FILE] [--baseline FILE] [--filter TEXT]
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.tl.custom import Message  # noqa: E402
+from telethon.tl.types import (  # noqa: E402
+    Document, DocumentAttributeAnimated, DocumentAttributeFilename, DocumentAttributeSticker,
+    DocumentAttributeVideo, InputStickerSetEmpty, MessageEntityUrl, MessageMediaDocument, PeerChannel, PhotoSize,
+)
+
+from job_queue import MemoryJobQueue, SqliteJobQueue  # noqa: E402
+from jobs import CorrelationIndex, LinkJob  # noqa: E402
+from storage import StateDB  # noqa: E402
+from thumbnails import ThumbnailStore, pick_thumb  # noqa: E402
+
+Runner = Callable[[int], object]  # Runs the measured operation n times, may return an awaitable
+
+LINK = "https://terabox.com/s/1AbCdEfGhIjKlMnOpQrStUv"
+
+
+def import_bot(directory: str):
+    """bot.py with placeholder settings; its state files go to `directory`."""
+    defaults = {
+        'API_ID': "1", 'API_HASH': "benchmark", 'YOUR_ADMIN_USER_ID': "1",
+        'SOURCE_CHANNEL_ID': "-1001", 'DESTINATION_CHANNEL_ID': "-1002",
+        'DOWNLOADER_BOT_USERNAME': "downloader", 'FILE_STORE_BOT_USERNAME': "file_store",
+        'STATE_DB_PATH': os.path.join(directory, "bot_state.db"), 'PORT': "0",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    # config.json is read from and written to the working directory
+    os.chdir(directory)
+    import bot
+    return bot
+
+
+def caption(links: int, length: int, entities: bool = True) -> Message:
+    """A channel post of about `length` characters carrying `links` Terabox links."""
+    parts, offset, url_entities = [], 0, []
+    filler = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+    for index in range(links):
+        url = f"https://terabox.com/s/1Link{index:04d}AbCdEfGh"
+        text = f"Part {index + 1}: "
+        url_entities.append(MessageEntityUrl(offset + len(text), len(url)))
+        text += url + "\n"
+        parts.append(text)
+        offset += len(text)
+    body = "".join(parts)
+    body += (filler * (max(0, length - len(body)) // len(filler) + 1))[:max(0, length - len(body))]
+    return Message(id=1, peer_id=PeerChannel(1), message=body, entities=url_entities if entities else None)
+
+
+def document_message(attributes: List) -> Message:
+    document = Document(1, 1, b"", None, "video/mp4", 50_000_000, 1, attributes)
+    return Message(id=1, peer_id=PeerChannel(1), message="", media=MessageMediaDocument(document=document))
+
+
+def drive(coroutine):
+    """Result of a coroutine that never suspends, without an event loop round trip."""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    raise RuntimeError("coroutine suspended")
+
+
+def extract_case(bot, message: Message) -> Runner:
+    def run(n):
+        for _ in range(n):
+            drive(bot.extract_terabox_links(message))
+    return run
+
+
+def media_case(bot, message: Message) -> Runner:
+    def run(n):
+        for _ in range(n):
+            bot.is_allowed_media(message)
+    return run
+
+
+def correlation_hit_case(size: int) -> Runner:
+    """Track a forwarded file and match the file store's reply to it, with `size` other entries."""
+    index = CorrelationIndex()
+    job = LinkJob(LINK, "")
+    for msg_id in range(size):
+        index.track_forwarded(msg_id, job)
+    next_id = [size]
+
+    def run(n):
+        for _ in range(n):
+            msg_id = next_id[0]
+            next_id[0] += 1
+            index.track_forwarded(msg_id, job)
+            index.match_file_store_reply(msg_id)
+    return run
+
+
+def correlation_fallback_case(size: int) -> Runner:
+    """A file without reply_to_msg_id from a bot none of the `size` tracked jobs was sent to."""
+    index = CorrelationIndex()
+    job = LinkJob(LINK, "")
+    job.sent_to_downloader("busy_bot")
+    for msg_id in range(size):
+        index.track_sent(msg_id, job)
+
+    def run(n):
+        for _ in range(n):
+            index.match_downloader_reply(None, "other_bot", "video.mp4")
+    return run
+
+
+def queue_case(queue) -> Runner:
+    payload = {'link': LINK, 'key': "terabox:AbCdEfGhIjKlMnOpQrStUv", 'text': "caption " * 20,
+               'thumbnail': "0" * 40, 'destinations': [-1002], 'chat_id': -1001, 'message_id': 1}
+
+    async def run(n):
+        for _ in range(n):
+            await queue.put(payload)
+            item_id, _ = await queue.get()
+            queue.ack(item_id)
+    return run
+
+
+def pick_thumb_case() -> Runner:
+    sizes = [PhotoSize(kind, side, side, side * side // 10)
+             for kind, side in (("s", 90), ("m", 320), ("x", 800), ("y", 1280), ("w", 2560))]
+
+    def run(n):
+        for _ in range(n):
+            pick_thumb(sizes, 800, 1024 * 1024)
+    return run
+
+
+def thumbnail_put_case(store: ThumbnailStore) -> Runner:
+    data = os.urandom(60_000)
+
+    def run(n):
+        for _ in range(n):
+            store.put(data)
+    return run
+
+
+def thumbnail_open_case(store: ThumbnailStore) -> Runner:
+    key = store.put(os.urandom(60_000))
+
+    def run(n):
+        for _ in range(n):
+            with store.open(key) as source:
+                source.read()
+    return run
+
+
+def build_cases(bot, db: StateDB) -> List[Tuple[str, Callable[[], Runner]]]:
+    many = [DocumentAttributeAnimated() for _ in range(60)] + [DocumentAttributeFilename("a.mp4")]
+    cases = [
+        ("extract_terabox_links/small_caption", lambda: extract_case(bot, caption(1, 200))),
+        ("extract_terabox_links/huge_caption", lambda: extract_case(bot, caption(40, 4096))),
+        ("extract_terabox_links/huge_caption_no_entities", lambda: extract_case(bot, caption(40, 4096, entities=False))),
+        ("is_allowed_media/video", lambda: media_case(bot, document_message(
+            [DocumentAttributeVideo(60, 1280, 720), DocumentAttributeFilename("a.mp4")]))),
+        ("is_allowed_media/many_attributes", lambda: media_case(bot, document_message(many))),
+        ("is_allowed_media/sticker_last", lambda: media_case(bot, document_message(
+            many + [DocumentAttributeSticker("", InputStickerSetEmpty())]))),
+    ]
+    for size in (10, 1_000, 100_000):
+        cases.append((f"correlation/reply_hit/{size}", lambda size=size: correlation_hit_case(size)))
+        cases.append((f"correlation/fallback_miss/{size}", lambda size=size: correlation_fallback_case(size)))
+    cases += [
+        ("queue/memory_put_get_ack", lambda: queue_case(MemoryJobQueue("bench"))),
+        ("queue/sqlite_put_get_ack", lambda: queue_case(SqliteJobQueue(db, "bench"))),
+        ("thumbnails/pick_thumb", pick_thumb_case),
+        ("thumbnails/store_put_60k", lambda: thumbnail_put_case(ThumbnailStore(64 * 1024 * 1024, 3600))),
+        ("thumbnails/store_open_read_60k", lambda: thumbnail_open_case(ThumbnailStore(64 * 1024 * 1024, 3600))),
+    ]
+    return cases
+
+
+async def measure(run: Runner, min_time: float, repeat: int) -> Tuple[float, int]:
+    """Best seconds per operation over `repeat` batches, and the batch size."""
+    async def timed(n: int) -> float:
+        start = time.perf_counter()
+        result = run(n)
+        if inspect.isawaitable(result):
+            await result
+        return time.perf_counter() - start
+
+    n = 1
+    while True:
+        elapsed = await timed(n)
+        if elapsed >= min_time:
+            break
+        n *= 10 if elapsed < min_time / 10 else 2
+    best = min([elapsed] + [await timed(n) for _ in range(repeat - 1)])
+    return best / n, n
+
+
+async def run_suite(args, bot, db: StateDB) -> Dict[str, dict]:
+    results = {}
+    for name, setup in build_cases(bot, db):
+        if args.filter and args.filter not in name:
+            continue
+        per_op, batch = await measure(setup(), args.min_time, args.repeat)
+        results[name] = {'ns_per_op': round(per_op * 1e9, 1), 'ops_per_second': round(1 / per_op), 'batch': batch}
+        if not args.json:
+            print(f"{name:<48} {per_op * 1e9:>14,.1f} ns/op {1 / per_op:>14,.0f} ops/s")
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Cases slower than their baseline by more than `threshold`."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = result['ns_per_op'] / before['ns_per_op'] - 1
+        if change > threshold:
+            regressions.append(f"{name}: {before['ns_per_op']:,.1f} -> {result['ns_per_op']:,.1f} ns/op ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file written by --save to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument("--filter", help="only run cases whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds one timed batch takes at least")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    baseline_path = args.baseline and os.path.abspath(args.baseline)
+    save_path = args.save and os.path.abspath(args.save)
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot = import_bot(directory)
+        db = StateDB(os.path.join(directory, "bench.db"))
+        try:
+            results = asyncio.run(run_suite(args, bot, db))
+        finally:
+            db.close()
+            bot.STATE_DB.close()
+
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    if args.json:
+        print(json.dumps(report, indent=2))
+    if save_path:
+        with open(save_path, "w") as f:
+            json.dump(report, f, indent=2)
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
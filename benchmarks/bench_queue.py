@@ -0,0 +1,79 @@
+"""Enqueue/dequeue throughput of the in-memory and SQLite job queues, and the
+memory one queued link takes as a dict and as a LinkRecord.
+
+Usage: python benchmarks/bench_queue.py [items]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import MemoryJobQueue, SqliteJobQueue  # noqa: E402
+from jobs import LinkRecord  # noqa: E402
+from storage import StateDB  # noqa: E402
+
+PAYLOAD = {
+    'link': 'https://terabox.com/s/1AbCdEfGhIjKlMnOpQrStUv',
+    'text': 'Some caption text with a link https://terabox.com/s/1AbCdEfGhIjKlMnOpQrStUv',
+    'thumbnail': 'da39a3ee5e6b4b0d3255bfef95601890afd80709',
+    'chat_id': -1001234567890,
+    'message_id': 123456,
+}
+
+
+def record(index: int) -> LinkRecord:
+    return LinkRecord(f"{PAYLOAD['link']}{index}", text=PAYLOAD['text'], thumbnail=PAYLOAD['thumbnail'],
+                      destinations=(-1009876543210,), chat_id=PAYLOAD['chat_id'], message_id=index,
+                      trace_id=f"{index:016x}", queued_at=time.time())
+
+
+async def bytes_per_item(make, items: int) -> float:
+    """Memory a MemoryJobQueue holds per queued item built by `make`."""
+    queue = MemoryJobQueue("bench")
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for index in range(items):
+        await queue.put(make(index))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / items
+
+
+async def run(queue, items: int):
+    start = time.perf_counter()
+    for _ in range(items):
+        await queue.put(PAYLOAD)
+    put_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(items):
+        item_id, _payload = await queue.get()
+        queue.ack(item_id)
+    get_time = time.perf_counter() - start
+    return items / put_time, items / get_time
+
+
+async def main(items: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = StateDB(os.path.join(tmp, "bench.db"))
+        queues = [
+            ("memory", MemoryJobQueue("bench")),
+            ("sqlite", SqliteJobQueue(db, "bench")),
+        ]
+        print(f"{'backend':<8} {'put/s':>12} {'get+ack/s':>12}  ({items} items)")
+        for name, queue in queues:
+            put_rate, get_rate = await run(queue, items)
+            print(f"{name:<8} {put_rate:>12,.0f} {get_rate:>12,.0f}")
+        print()
+        as_dict = await bytes_per_item(lambda index: record(index).to_dict(), items)
+        as_record = await bytes_per_item(record, items)
+        print(f"bytes per queued link: dict {as_dict:,.0f}, LinkRecord {as_record:,.0f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,483 @@
+"""Offline end-to-end run of bot.py against simulated Telegram peers.
+
+SimClient replaces the TelegramClient with the handful of calls bot.py
+makes, on top of real Telethon message objects held in memory. Simulated
+downloader and file store bots answer with a configurable latency, jitter,
+failure rate and number of files, and either reply to the message they
+answer or not. The load generator posts synthetic source messages and
+reports throughput, end-to-end latency and peak memory; nothing touches the
+network, so it can run in CI.
+
+Bot settings come from the environment as usual. Rate limits and timeouts
+default to values that suit the simulated latencies; export a variable to
+override one.
+
+Usage: python benchmarks/simulate.py [--messages N] [--rate R] [--json] ...
+"""
+import argparse
+import asyncio
+import importlib
+import inspect
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon import events, utils  # noqa: E402
+from telethon._updates import EntityCache  # noqa: E402
+from telethon.extensions import markdown  # noqa: E402
+from telethon.tl.custom import Message  # noqa: E402
+from telethon.tl.types import (  # noqa: E402
+    Channel, ChatPhotoEmpty, Document, DocumentAttributeFilename, DocumentAttributeVideo, InputFile,
+    MessageEntityUrl, MessageFwdHeader, MessageMediaDocument, MessageMediaPhoto, MessageReplyHeader,
+    PeerUser, Photo, PhotoSize, User,
+)
+
+from bot_pool import percentile_of  # noqa: E402
+
+logger = logging.getLogger("simulate")
+
+SELF_ID = 1000
+SOURCE_CHANNEL_ID = -1001000000001
+DESTINATION_CHANNEL_ID = -1001000000002
+FILE_STORE_LINK = re.compile(r"start=(\S+)_\d+")
+
+
+def now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SimBot:
+    """A bot at the other end of a private chat with the account."""
+
+    def __init__(self, username: str, latency: float = 0.2, jitter: float = 0.1,
+                 failure_rate: float = 0.0, reply: bool = True, rng: Optional[random.Random] = None):
+        self.username = username
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.reply = reply
+        self.rng = rng or random.Random()
+        self.user_id = 0
+        self.received = 0
+        self.dropped = 0
+
+    def delay(self) -> float:
+        return max(0.0, self.rng.uniform(self.latency - self.jitter, self.latency + self.jitter))
+
+    def fails(self) -> bool:
+        if self.rng.random() < self.failure_rate:
+            self.dropped += 1
+            return True
+        return False
+
+    async def receive(self, client: "SimClient", message: Message):
+        raise NotImplementedError
+
+
+class SimDownloaderBot(SimBot):
+    """Answers a link with between `min_files` and `max_files` videos."""
+
+    def __init__(self, username: str, min_files: int = 1, max_files: int = 1, file_gap: float = 0.05, **options):
+        super().__init__(username, **options)
+        self.min_files = min_files
+        self.max_files = max_files
+        self.file_gap = file_gap
+
+    async def receive(self, client: "SimClient", message: Message):
+        self.received += 1
+        await asyncio.sleep(self.delay())
+        if self.fails():
+            return
+        share_id = message.message.rstrip("/").rsplit("/", 1)[-1]
+        for index in range(self.rng.randint(self.min_files, self.max_files)):
+            if index:
+                await asyncio.sleep(self.file_gap)
+            client.bot_message(self, media=client.video(f"{share_id}_{index}.mp4"),
+                               reply_to=message.id if self.reply else None)
+
+
+class SimFileStoreBot(SimBot):
+    """Answers every forwarded file with a store link naming that file."""
+
+    async def receive(self, client: "SimClient", message: Message):
+        if not message.media:
+            return
+        self.received += 1
+        await asyncio.sleep(self.delay())
+        if self.fails():
+            return
+        name = message.file.name.rsplit(".", 1)[0]
+        client.bot_message(self, text=f"🖇️ Link: https://t.me/{self.username}?start={name}",
+                           reply_to=message.id if self.reply else None)
+
+
+class SimClient:
+    """The part of TelegramClient bot.py uses, backed by in-memory chats.
+
+    Messages are real Telethon `Message` objects, so attribute access, media
+    helpers and `forward_to` behave as they do against Telegram. Incoming
+    messages are dispatched to the NewMessage handlers through their own
+    filters, each update in its own task.
+    """
+
+    def __init__(self, self_id: int = SELF_ID):
+        self._self_id = self_id
+        self._mb_entity_cache = EntityCache(self_id=self_id, self_bot=False)
+        self.parse_mode = markdown
+        self.entities: Dict[int, object] = {}
+        self.usernames: Dict[str, int] = {}
+        self.bots: Dict[int, SimBot] = {}
+        self.history: Dict[int, List[Message]] = defaultdict(list)
+        self.handlers = []
+        self.posts: List[tuple] = []  # (monotonic time, chat id, message) the account posted to channels
+        self.uploaded_bytes = 0
+        # Private chats share one message id sequence per account, channels count their own
+        self._private_ids = itertools.count(1)
+        self._channel_ids: Dict[int, itertools.count] = defaultdict(lambda: itertools.count(1))
+        self._media_ids = itertools.count(1)
+        self._tasks = set()
+
+    @property
+    def busy(self) -> bool:
+        """Whether any update or bot answer is still being worked on."""
+        return bool(self._tasks)
+
+    def add_channel(self, chat_id: int, title: str) -> int:
+        channel = Channel(utils.resolve_id(chat_id)[0], title, ChatPhotoEmpty(), now(), broadcast=True, access_hash=1)
+        self.entities[chat_id] = channel
+        self._mb_entity_cache.extend([], [channel])
+        return chat_id
+
+    def add_bot(self, bot: SimBot) -> SimBot:
+        bot.user_id = 5000 + len(self.bots)
+        user = User(bot.user_id, bot=True, access_hash=1, username=bot.username, first_name=bot.username)
+        self.entities[bot.user_id] = user
+        self._mb_entity_cache.extend([user], [])
+        self.usernames[bot.username.lower()] = bot.user_id
+        self.bots[bot.user_id] = bot
+        return bot
+
+    # Media
+
+    def photo(self, size: int = 60_000) -> MessageMediaPhoto:
+        sizes = [PhotoSize("m", 320, 320, size // 8), PhotoSize("x", 800, 800, size)]
+        return MessageMediaPhoto(photo=Photo(next(self._media_ids), 1, b"", now(), sizes, 1))
+
+    def video(self, file_name: str, size: int = 50_000_000) -> MessageMediaDocument:
+        attributes = [DocumentAttributeVideo(60, 1280, 720), DocumentAttributeFilename(file_name)]
+        return MessageMediaDocument(document=Document(next(self._media_ids), 1, b"", now(), "video/mp4", size, 1, attributes))
+
+    # Messages
+
+    def _store(self, chat_id: int, out: bool, text: str = "", media=None, reply_to: Optional[int] = None,
+               entities=None, fwd_from=None, grouped_id: Optional[int] = None) -> Message:
+        peer = utils.get_peer(chat_id)
+        is_channel = chat_id in self.entities and isinstance(self.entities[chat_id], Channel)
+        message_id = next(self._channel_ids[chat_id] if is_channel else self._private_ids)
+        message = Message(
+            id=message_id, peer_id=peer, date=now(), message=text, out=out, post=is_channel,
+            media=media, entities=entities, fwd_from=fwd_from, grouped_id=grouped_id,
+            reply_to=MessageReplyHeader(reply_to_msg_id=reply_to) if reply_to else None,
+        )
+        message._finish_init(self, self.entities, None)
+        self.history[chat_id].append(message)
+        return message
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def post_to_channel(self, chat_id: int, text: str, media=None, grouped_id: Optional[int] = None) -> Message:
+        """A new post in `chat_id` by someone else, dispatched to the handlers."""
+        entities = [MessageEntityUrl(match.start(), match.end() - match.start())
+                    for match in re.finditer(r"https?://\S+", text)]
+        message = self._store(chat_id, out=False, text=text, media=media, entities=entities, grouped_id=grouped_id)
+        self._spawn(self._dispatch(message))
+        return message
+
+    def post_album(self, chat_id: int, text: str, size: int) -> List[Message]:
+        """An album of `size` photos captioned with `text` on the first, one update per photo."""
+        grouped_id = next(self._media_ids)
+        return [self.post_to_channel(chat_id, text if index == 0 else "", media=self.photo(), grouped_id=grouped_id)
+                for index in range(size)]
+
+    def bot_message(self, bot: SimBot, text: str = "", media=None, reply_to: Optional[int] = None) -> Message:
+        """A message `bot` sends to the account, dispatched to the handlers."""
+        message = self._store(bot.user_id, out=False, text=text, media=media, reply_to=reply_to)
+        self._spawn(self._dispatch(message))
+        return message
+
+    def _deliver(self, chat_id: int, message: Message):
+        bot = self.bots.get(chat_id)
+        if bot is not None:
+            self._spawn(bot.receive(self, message))
+        elif isinstance(self.entities.get(chat_id), Channel):
+            self.posts.append((time.monotonic(), chat_id, message))
+
+    async def _dispatch(self, message: Message):
+        for callback, builder in self.handlers:
+            event = events.NewMessage.Event(message)
+            event._entities = self.entities
+            event._set_client(self)
+            if not builder.resolved:
+                await builder.resolve(self)
+            passed = builder.filter(event)
+            if inspect.isawaitable(passed):
+                passed = await passed
+            if passed:
+                try:
+                    await callback(event)
+                except Exception:
+                    logger.exception(f"Handler {callback.__name__} failed")
+
+    # TelegramClient surface
+
+    def add_event_handler(self, callback, event):
+        self.handlers.append((callback, event))
+
+    def list_event_handlers(self):
+        return list(self.handlers)
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def disconnect(self):
+        pass
+
+    async def get_peer_id(self, peer) -> int:
+        return self._chat_id(peer)
+
+    def _chat_id(self, peer) -> int:
+        if isinstance(peer, int):
+            return peer
+        if isinstance(peer, str):
+            return self.usernames[peer.strip().lstrip("@").lower()]
+        return utils.get_peer_id(peer)
+
+    async def send_message(self, entity, message: str = "", reply_to: Optional[int] = None, **kwargs) -> Message:
+        chat_id = self._chat_id(entity)
+        sent = self._store(chat_id, out=True, text=message, reply_to=reply_to)
+        self._deliver(chat_id, sent)
+        return sent
+
+    async def send_file(self, entity, file, caption: str = "", **kwargs) -> Message:
+        chat_id = self._chat_id(entity)
+        media = MessageMediaPhoto(photo=file) if isinstance(file, Photo) else self.photo()
+        sent = self._store(chat_id, out=True, text=caption, media=media)
+        self._deliver(chat_id, sent)
+        return sent
+
+    async def upload_file(self, file, file_name: Optional[str] = None, **kwargs) -> InputFile:
+        data = file.read() if hasattr(file, "read") else bytes(file)
+        self.uploaded_bytes += len(data)
+        return InputFile(next(self._media_ids), 1, file_name or "file", "")
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        chat_id = self._chat_id(entity)
+        source = self._chat_id(from_peer)
+        ids = [messages] if isinstance(messages, int) else list(messages)
+        forwarded = []
+        for original in self.history[source]:
+            if original.id in ids:
+                header = MessageFwdHeader(now(), from_id=PeerUser(original.sender_id))
+                copy = self._store(chat_id, out=True, text=original.message, media=original.media, fwd_from=header)
+                self._deliver(chat_id, copy)
+                forwarded.append(copy)
+        return forwarded[0] if isinstance(messages, int) and forwarded else forwarded
+
+    async def download_media(self, message: Message, file=None, thumb=None, **kwargs) -> bytes:
+        size = getattr(thumb, "size", 20_000)
+        return message.id.to_bytes(8, "big") * (size // 8)
+
+    async def get_messages(self, chat, ids: Optional[int] = None, limit: Optional[int] = None, **kwargs):
+        history = self.history[self._chat_id(chat)]
+        if isinstance(ids, list):
+            by_id = {message.id: message for message in history}
+            return [by_id.get(message_id) for message_id in ids]
+        if ids is not None:
+            return next((message for message in history if message.id == ids), None)
+        return list(reversed(history))[:limit]
+
+    async def iter_messages(self, chat, limit: Optional[int] = None, min_id: int = 0, max_id: int = 0,
+                            reverse: bool = False, **kwargs):
+        history = [message for message in self.history[self._chat_id(chat)]
+                   if message.id > min_id and (not max_id or message.id < max_id)]
+        if not reverse:
+            history.reverse()
+        for message in history[:limit]:
+            yield message
+
+
+def configure_environment(args, directory: str):
+    """Settings bot.py reads on import, scaled to the simulated latencies."""
+    timeout = max(5.0, 10 * max(args.downloader_latency, args.store_latency))
+    defaults = {
+        'API_ID': "1", 'API_HASH': "simulated", 'YOUR_ADMIN_USER_ID': "1",
+        'SOURCE_CHANNEL_ID': str(SOURCE_CHANNEL_ID), 'DESTINATION_CHANNEL_ID': str(DESTINATION_CHANNEL_ID),
+        'DOWNLOADER_BOT_USERNAME': ",".join(f"sim_downloader_{i}" for i in range(1, args.downloaders + 1)),
+        'FILE_STORE_BOT_USERNAME': "sim_file_store",
+        'STATE_DB_PATH': os.path.join(directory, "bot_state.db"),
+        'PORT': "0", 'BACKFILL_ON_START': "False",
+        'LINK_SETTLE_SECONDS': str(args.settle), 'LINK_TIMEOUT': str(timeout),
+        'FORWARD_BATCH_WINDOW': str(args.forward_window), 'ALBUM_WINDOW': str(args.album_window), 'POST_COALESCE': str(args.coalesce_posts),
+        'STAGE_TIMEOUT_MIN': "1", 'RETRY_BASE_DELAY': "0.5", 'RETRY_MAX_DELAY': "5",
+        'OUTBOUND_PEER_RATE': "1000", 'OUTBOUND_PEER_BURST': "1000",
+        'OUTBOUND_GLOBAL_RATE': "10000", 'DESTINATION_POST_RATE': "1000",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    # config.json is read from and written to the working directory
+    os.chdir(directory)
+
+
+async def simulate(args, bot) -> dict:
+    rng = random.Random(args.seed)
+    sim = SimClient()
+    sim.add_channel(SOURCE_CHANNEL_ID, "Simulated source")
+    sim.add_channel(DESTINATION_CHANNEL_ID, "Simulated destination")
+    bot_options = {'reply': not args.no_reply, 'rng': rng}
+    downloaders = [
+        sim.add_bot(SimDownloaderBot(
+            f"sim_downloader_{i}", min_files=1, max_files=args.max_files,
+            latency=args.downloader_latency, jitter=args.jitter, failure_rate=args.failure_rate, **bot_options
+        ))
+        for i in range(1, args.downloaders + 1)
+    ]
+    store = sim.add_bot(SimFileStoreBot(
+        "sim_file_store", latency=args.store_latency, jitter=args.jitter,
+        failure_rate=args.store_failure_rate, **bot_options
+    ))
+    for callback, event in bot.client.list_event_handlers():
+        sim.add_event_handler(callback, event)
+    bot.client = sim
+
+    await bot.apply_config(bot.config_manager.data)
+    bot.LIVE_INGEST_OPEN.set()
+    bot.start_workers()
+
+    posted_at: Dict[str, float] = {}
+    started = time.monotonic()
+    for i in range(args.messages):
+        links = [f"https://terabox.com/s/1sim{i:07d}x{j}" for j in range(args.links_per_message)]
+        text = f"Synthetic post {i}\n" + "\n".join(links)
+        if args.album_size > 1:
+            sim.post_album(SOURCE_CHANNEL_ID, text, args.album_size)
+        else:
+            sim.post_to_channel(SOURCE_CHANNEL_ID, text, media=sim.photo())
+        posted_at.update((link.rsplit("/", 1)[-1], time.monotonic()) for link in links)
+        if args.rate:
+            await asyncio.sleep(1 / args.rate)
+    ingest_done = time.monotonic()
+
+    def idle() -> bool:
+        queues = (bot.MESSAGE_QUEUE, bot.LINK_QUEUE)
+        buffered = len(bot.ALBUMS) or len(bot.FORWARD_BATCHER)
+        return not sim.busy and not bot.PENDING_DOWNLOADS and not buffered and not any(
+            queue.qsize() or queue.in_flight() or queue.delayed() for queue in queues
+        )
+
+    deadline = time.monotonic() + args.timeout
+    while not idle() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    finished = time.monotonic()
+    timed_out = not idle()
+
+    for task in bot.WORKER_TASKS.values():
+        task.cancel()
+    await asyncio.gather(*bot.WORKER_TASKS.values(), return_exceptions=True)
+
+    first_post: Dict[str, float] = {}
+    for posted, _chat_id, message in sim.posts:
+        # A combined post (POST_COALESCE) carries the links of several share ids
+        for match in FILE_STORE_LINK.finditer(message.message or ""):
+            first_post.setdefault(match.group(1), posted)
+    latencies = [first_post[share_id] - posted_at[share_id] for share_id in first_post if share_id in posted_at]
+    elapsed = finished - started
+    return {
+        'messages': args.messages,
+        'links': len(posted_at),
+        'links_posted': len(first_post),
+        'posts': len(sim.posts),
+        'dead_letters': len(bot.DEAD_LETTERS),
+        # Neither posted nor dead-lettered, e.g. finished with files meant for another link
+        'links_lost': len(posted_at) - len(first_post) - len(bot.DEAD_LETTERS),
+        'links_submitted': sum(downloader.received for downloader in downloaders),
+        'downloader_dropped': sum(downloader.dropped for downloader in downloaders),
+        'file_store_dropped': store.dropped,
+        'forward_calls': bot.FORWARD_BATCHER.batches,
+        'forwarded_files': bot.FORWARD_BATCHER.items,
+        'timed_out': timed_out,
+        'ingest_seconds': round(ingest_done - started, 3),
+        'elapsed_seconds': round(elapsed, 3),
+        'links_per_second': round(len(first_post) / elapsed, 3) if elapsed else None,
+        'latency_p50': round(percentile_of(latencies, 50), 3) if latencies else None,
+        'latency_p99': round(percentile_of(latencies, 99), 3) if latencies else None,
+        # ru_maxrss is in KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'uploaded_bytes': sim.uploaded_bytes,
+        'stages': bot.TRACER.stats(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=200, help="synthetic source messages to post")
+    parser.add_argument("--links-per-message", type=int, default=1)
+    parser.add_argument("--album-size", type=int, default=1, help="photos per source post, more than 1 posts albums")
+    parser.add_argument("--rate", type=float, default=0, help="source messages per second, 0 posts them all at once")
+    parser.add_argument("--downloaders", type=int, default=2, help="simulated downloader bots")
+    parser.add_argument("--downloader-latency", type=float, default=0.3, help="seconds until the first file")
+    parser.add_argument("--store-latency", type=float, default=0.1, help="seconds until the store link")
+    parser.add_argument("--jitter", type=float, default=0.1, help="latencies vary by up to this many seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of links a downloader ignores")
+    parser.add_argument("--store-failure-rate", type=float, default=0.0, help="share of files the store ignores")
+    parser.add_argument("--max-files", type=int, default=1, help="files a downloader sends per link, at most")
+    parser.add_argument("--no-reply", action="store_true", help="bots answer without replying to the message")
+    parser.add_argument("--settle", type=float, default=0.2, help="LINK_SETTLE_SECONDS unless already set")
+    parser.add_argument("--coalesce-posts", action="store_true", help="set POST_COALESCE unless already set")
+    parser.add_argument("--album-window", type=float, default=0.1, help="ALBUM_WINDOW unless already set")
+    parser.add_argument("--forward-window", type=float, default=0.1, help="FORWARD_BATCH_WINDOW unless already set")
+    parser.add_argument("--timeout", type=float, default=300, help="give up waiting for the pipeline to drain")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(args, directory)
+        bot = importlib.import_module("bot")
+        logging.getLogger().setLevel(args.log_level)
+        try:
+            report = asyncio.run(simulate(args, bot))
+        finally:
+            bot.STATE_DB.close()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        stages = report.pop('stages')
+        for name, value in report.items():
+            print(f"{name:<20} {value}")
+        print(f"\n{'stage':<20} {'count':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+        for stage, stats in stages.items():
+            print(f"{stage:<20} {stats['count']:>7} {stats['p50']:>8} {stats['p90']:>8} {stats['p99']:>8} {stats['max']:>8}")
+    return 1 if report['timed_out'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,14 +3,39 @@ import re
 import json
 import asyncio
 from telethon import TelegramClient, events
+from telethon.errors import FloodWaitError
 from decouple import config
 import logging
-from telethon.sessions import StringSession
-from telethon.tl.types import Message, MessageMediaPhoto, MessageMediaDocument, DocumentAttributeSticker
-from typing import Dict, Optional, List, Tuple
-from collections import defaultdict
+import random
+import socket
 import tempfile
+import time
+from telethon.sessions import StringSession
+from telethon.tl.types import (
+    Message, MessageMediaPhoto, MessageMediaDocument, DocumentAttributeFilename, DocumentAttributeSticker
+)
+from typing import Any, Dict, Optional, List, Tuple
+from collections import defaultdict, deque
 from telethon.helpers import strip_text
+from bot_pool import DownloaderPool, normalize_username, percentile_of
+from dedup import SeenLinkIndex
+from batching import Coalescer, CompletionGroups
+from jobs import CorrelationIndex, JobState, LinkJob, LinkRecord, StageTimeout
+from links import TERABOX_HOSTS, LinkExtractor, canonical_link
+from job_queue import DeadLetterStore, open_queue
+from monitoring import Counters, MonitoringServer, format_metrics
+from routing import PeerFilter, Router
+from rate_limiter import (
+    PRIORITY_FETCH,
+    PRIORITY_FORWARD,
+    PRIORITY_POST,
+    PRIORITY_SUBMIT,
+    OutboundScheduler,
+)
+from storage import StateDB
+from thumbnails import ThumbnailStore, UploadCache, download_thumbnail
+from timer_wheel import TimerWheel
+from tracing import Tracer, new_trace_id
 
 # Configure logging
 logging.basicConfig(format='[%(levelname) 5s/%(asctime)s] %(name)s: %(message)s', level=logging.INFO)
@@ -30,15 +55,89 @@ FILE_STORE_BOT_USERNAME = config("FILE_STORE_BOT_USERNAME")
 DESTINATION_CHANNEL_ID = config("DESTINATION_CHANNEL_ID", cast=int)
 
 
+# Pipeline tuning
+LINK_WORKERS = config("LINK_WORKERS", default=3, cast=int)  # Links in flight at the same time
+LINK_TIMEOUT = config("LINK_TIMEOUT", default=150, cast=float)  # Longest a link may stay in one stage
+STAGE_TIMEOUT_FACTOR = config("STAGE_TIMEOUT_FACTOR", default=3.0, cast=float)  # A stage may take this many times the bot's recent p95
+STAGE_TIMEOUT_MIN = config("STAGE_TIMEOUT_MIN", default=20, cast=float)  # Floor of an adaptive stage timeout
+STAGE_TIMEOUT_SAMPLES = config("STAGE_TIMEOUT_SAMPLES", default=5, cast=int)  # Latencies needed before a stage timeout adapts
+LINK_MAX_ATTEMPTS = config("LINK_MAX_ATTEMPTS", default=3, cast=int)  # Tries before a link goes to the dead-letter queue
+RETRY_BASE_DELAY = config("RETRY_BASE_DELAY", default=30, cast=float)  # Seconds before the first retry, doubled for each one after
+RETRY_MAX_DELAY = config("RETRY_MAX_DELAY", default=600, cast=float)  # Longest wait between two attempts
+HTTP_PORT = config("PORT", default=8080, cast=int)  # Port of /healthz and /metrics, 0 turns the server off
+HEALTH_STALL_SECONDS = config("HEALTH_STALL_SECONDS", default=600, cast=float)  # A backlog that did not move this long is unhealthy
+TRACE_EXPORT_PATH = config("TRACE_EXPORT_PATH", default="")  # Append every stage span to this JSON lines file (disabled when empty)
+THUMB_TARGET_SIZE = config("THUMB_TARGET_SIZE", default=800, cast=int)  # Preferred longer side of the cover image in px
+THUMB_MAX_BYTES = config("THUMB_MAX_BYTES", default=1024 * 1024, cast=int)  # Never download a cover image bigger than this
+THUMB_CACHE_BYTES = config("THUMB_CACHE_BYTES", default=64 * 1024 * 1024, cast=int)  # In-memory thumbnail budget
+THUMB_CACHE_TTL = config("THUMB_CACHE_TTL", default=6 * 3600, cast=float)  # Seconds an unused thumbnail is kept
+THUMB_CACHE_DIR = config("THUMB_CACHE_DIR", default="")  # Spill evicted thumbnails here (disabled when empty)
+THUMB_DISK_BYTES = config("THUMB_DISK_BYTES", default=512 * 1024 * 1024, cast=int)  # Budget of THUMB_CACHE_DIR
+LINK_SETTLE_SECONDS = config("LINK_SETTLE_SECONDS", default=5, cast=float)  # Quiet period before a posted link counts as done
+FORWARD_BATCH_WINDOW = config("FORWARD_BATCH_WINDOW", default=1.0, cast=float)  # Seconds downloader files of one link are collected before forwarding, 0 forwards each at once
+POST_COALESCE = config("POST_COALESCE", default=False, cast=bool)  # One destination post per source message instead of one per file store link
+POST_COALESCE_DEADLINE = config("POST_COALESCE_DEADLINE", default=600, cast=float)  # Seconds before a combined post goes out without its slowest links
+ALBUM_WINDOW = config("ALBUM_WINDOW", default=1.0, cast=float)  # Seconds to wait for the rest of a source album before queueing it as one message
+FORWARD_BATCH_MAX = config("FORWARD_BATCH_MAX", default=100, cast=int)  # Files forwarded in one call at most (Telegram allows 100)
+QUEUE_BACKEND = config("QUEUE_BACKEND", default="sqlite")  # "sqlite" survives restarts, "memory" keeps the old behaviour
+STATE_DB_PATH = config("STATE_DB_PATH", default="bot_state.db")  # SQLite file holding queues and other bot state
+STATE_DB_BATCH = config("STATE_DB_BATCH", default=64, cast=int)  # Writes grouped into one commit
+DEDUP_TTL = config("DEDUP_TTL", default=30 * 86400, cast=float)  # Seconds a handled link counts as duplicate
+DEDUP_CAPACITY = config("DEDUP_CAPACITY", default=1_000_000, cast=int)  # Expected distinct links, sizes the Bloom filter
+DUPLICATE_MODE = config("DUPLICATE_MODE", default="skip")  # "skip" duplicates or "repost" their cached file store links
+BACKFILL_ON_START = config("BACKFILL_ON_START", default=True, cast=bool)  # Catch up on source posts missed while offline
+BACKFILL_MAX_MESSAGES = config("BACKFILL_MAX_MESSAGES", default=10000, cast=int)  # Cap of one startup catch-up
+OUTBOUND_PEER_RATE = config("OUTBOUND_PEER_RATE", default=1.0, cast=float)  # Calls per second to one chat
+OUTBOUND_PEER_BURST = config("OUTBOUND_PEER_BURST", default=3, cast=float)  # Calls one chat may take at once
+OUTBOUND_GLOBAL_RATE = config("OUTBOUND_GLOBAL_RATE", default=20, cast=float)  # Calls per second for the whole account
+DESTINATION_POST_RATE = config("DESTINATION_POST_RATE", default=0.5, cast=float)  # Posts per second to the destination channel
+DOWNLOADER_QUARANTINE_AFTER = config("DOWNLOADER_QUARANTINE_AFTER", default=3, cast=int)  # Timeouts in a row before a downloader bot is benched
+DOWNLOADER_QUARANTINE_SECONDS = config("DOWNLOADER_QUARANTINE_SECONDS", default=600, cast=float)  # How long it stays benched
+BACKFILL_MAX_PENDING = config("BACKFILL_MAX_PENDING", default=500, cast=int)  # Backfill pauses while this many messages are queued
+WORKER_ID = config("WORKER_ID", default=f"{socket.gethostname()}:{os.getpid()}")  # Unique per process; a fixed one resumes its items right after a restart
+QUEUE_LEASE_SECONDS = config("QUEUE_LEASE_SECONDS", default=300, cast=float)  # Queue items of a silent process go to others after this
+QUEUE_MAX_ITEMS = config("QUEUE_MAX_ITEMS", default=10000, cast=int)  # Ready items per queue before producers wait, 0 for no limit
+QUEUE_SPILL = config("QUEUE_SPILL", default=False, cast=bool)  # Memory backend: park items over QUEUE_MAX_ITEMS in STATE_DB_PATH instead of waiting
+LIVE_MESSAGES_MAX = config("LIVE_MESSAGES_MAX", default=1000, cast=int)  # Queued source messages kept in memory, the rest is fetched again
+
 CONFIG_FILE = "config.json"
-TERABOX_REGEX = r"(?:https?://(?:www\.)?(?:1024terabox\.com|terabox\.com|teraboxlink\.com|terafileshare\.com|teraboxshare\.com|teraboxapp\.com|terasharelink\.com)/\S+)"
-MESSAGE_QUEUE = asyncio.Queue()  # Queue for all source channel messages
-LINK_QUEUE = asyncio.Queue()    # Queue for messages with Terabox links
-LINK_THUMBNAIL_MAP: Dict[str, bytes] = {}
-PENDING_DOWNLOADS: Dict[str, asyncio.Event] = {}
-FILE_STORE_RESPONSES: Dict[int, dict] = {}
-CURRENT_PROCESSING = None
-PROCESSING_LOCK = asyncio.Lock()
+STATE_DB = StateDB(STATE_DB_PATH, batch_size=STATE_DB_BATCH)
+QUEUE_OPTIONS = {'maxsize': QUEUE_MAX_ITEMS, 'spill': QUEUE_SPILL}
+if QUEUE_BACKEND == "sqlite":
+    QUEUE_OPTIONS.update(worker_id=WORKER_ID, lease_seconds=QUEUE_LEASE_SECONDS)
+MESSAGE_QUEUE = open_queue(QUEUE_BACKEND, "messages", STATE_DB, **QUEUE_OPTIONS)  # Queue for all source channel messages
+LINK_QUEUE = open_queue(QUEUE_BACKEND, "links", STATE_DB, record_type=LinkRecord, **QUEUE_OPTIONS)  # LinkRecords of Terabox links
+SEEN_LINKS = SeenLinkIndex(STATE_DB, DEDUP_TTL, DEDUP_CAPACITY)
+DEAD_LETTERS = DeadLetterStore(STATE_DB)  # Links that failed LINK_MAX_ATTEMPTS times
+OUTBOUND = OutboundScheduler(OUTBOUND_PEER_RATE, OUTBOUND_PEER_BURST, OUTBOUND_GLOBAL_RATE)
+OUTBOUND.set_rate("fetch", OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_RATE)  # Reading history is not limited per chat
+LIVE_MESSAGES: Dict[Tuple[int, int], Message] = {}  # Messages queued by this run, saves refetching them
+QUEUED_SOURCE_IDS: Dict[int, set] = defaultdict(set)  # Source message ids queued but not processed, per chat
+LIVE_INGEST_OPEN = asyncio.Event()  # Live messages wait for the startup catch-up so ids stay in order
+PENDING_DOWNLOADS: Dict[int, LinkJob] = {}  # In-flight jobs by job id
+THUMBNAIL_STORE = ThumbnailStore(THUMB_CACHE_BYTES, THUMB_CACHE_TTL, THUMB_CACHE_DIR or None, THUMB_DISK_BYTES)
+UPLOAD_CACHE = UploadCache()  # Thumbnail content hash -> photo already uploaded to Telegram
+TIMERS = TimerWheel(tick=1.0)  # TTLs of correlation entries
+CORRELATION_INDEX = CorrelationIndex(  # Message ids -> jobs along the downloader/file store chain
+    wheel=TIMERS, ttl=LINK_TIMEOUT, on_expire=lambda job, kind: correlation_expired(job, kind)
+)
+FORWARD_BATCHER = Coalescer(  # Downloader files per (bot chat, job), forwarded together
+    lambda key, files: forward_to_file_store(key, files), FORWARD_BATCH_WINDOW, FORWARD_BATCH_MAX
+)
+ALBUMS = Coalescer(  # Parts of live source albums per (chat, grouped_id), queued together
+    lambda key, messages: enqueue_source_album(messages, force=True), ALBUM_WINDOW, max_items=10
+)
+POST_GROUPS = CompletionGroups(  # File store links held per source message while POST_COALESCE is on
+    lambda group, posts: publish_post_group(group, posts), POST_COALESCE_DEADLINE
+)
+FILE_STORE_LATENCIES = deque(maxlen=50)  # Recent seconds between forwarding a file and getting its link
+WORKER_TASKS: Dict[str, asyncio.Task] = {}  # Long running tasks the health check watches
+LAST_PROGRESS = {'messages': time.monotonic(), 'links': time.monotonic()}  # When each queue last moved
+COUNTERS = Counters()
+TRACER = Tracer(TRACE_EXPORT_PATH or None)  # Stage latency histograms of every link
+COUNTERS.describe("bot_links_total", "Links finished by this process, by outcome")
+COUNTERS.describe("bot_posts_total", "File store links posted to destinations")
+COUNTERS.describe("bot_errors_total", "Errors caught in the pipeline, by where they happened")
 
 # Allowed MIME types for forwarding
 ALLOWED_MIME_TYPES = {
@@ -46,6 +145,8 @@ ALLOWED_MIME_TYPES = {
     'audio/',
     'application/',  # For general files
 }
+CAPTION_MAX_LENGTH = 1024  # Telegram's limit for a media caption
+MESSAGE_MAX_LENGTH = 4096  # and for a text message
 
 def is_allowed_media(message: Message) -> bool:
     """Check if the media type is allowed for forwarding."""
@@ -86,193 +187,690 @@ class Config:
             self.save_config()
 
     def save_config(self):
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(self.data, f, indent=4)
+        self.write_config(self.data)
 
-    def update_config(self, key: str, value: str):
-        self.data[key] = value
-        self.save_config()
+    @staticmethod
+    def write_config(data: dict):
+        """Replace CONFIG_FILE in one step, a crash never leaves half a file behind."""
+        directory = os.path.dirname(os.path.abspath(CONFIG_FILE))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".config-", suffix=".json")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, CONFIG_FILE)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    async def update_config(self, changes: Dict[str, Any]):
+        """Merge `changes` and write the file from a worker thread."""
+        data = {**self.data, **changes}
+        await asyncio.get_running_loop().run_in_executor(None, self.write_config, data)
+        self.data = data
 
 config_manager = Config()
+CONFIG_LOCK = asyncio.Lock()  # One reconfiguration at a time
+
+def routing_config(data: dict) -> dict:
+    """`data` with the environment's channel pair filled in where config.json has none."""
+    return {"source_channel": SOURCE_CHANNEL_ID, "destination_channel": DESTINATION_CHANNEL_ID, **data}
+
+def configured_downloader_bots(data: dict) -> List[str]:
+    """Downloader bots from config.json, or the comma separated DOWNLOADER_BOT_USERNAME.
+    
+    A config.json written before downloader_bots existed names its one bot
+    under downloader_bot.
+    """
+    bots = data.get("downloader_bots")
+    if not bots:
+        bots = re.split(r"[,\s]+", data.get("downloader_bot") or DOWNLOADER_BOT_USERNAME)
+    return [bot for bot in bots if bot]
+
+# Everything below is rebuilt by apply_config when the configuration changes
+LINK_EXTRACTOR = LinkExtractor(config_manager.data.get("link_hosts") or TERABOX_HOSTS)
+# Source chat -> destinations, from the "routes" list of config.json or its single channel pair
+ROUTER = Router.from_config(routing_config(config_manager.data))
+FILE_STORE_BOT = config_manager.data.get("file_store_bot") or FILE_STORE_BOT_USERNAME
+for destination in ROUTER.destinations:
+    OUTBOUND.set_rate(destination, DESTINATION_POST_RATE)
+# Peers the event handlers accept; filled in once the client can resolve usernames
+SOURCE_FILTER = PeerFilter()
+DOWNLOADER_FILTER = PeerFilter()
+FILE_STORE_FILTER = PeerFilter()
+
+DOWNLOADER_POOL = DownloaderPool(
+    configured_downloader_bots(config_manager.data),
+    quarantine_after=DOWNLOADER_QUARANTINE_AFTER,
+    quarantine_seconds=DOWNLOADER_QUARANTINE_SECONDS
+)
 
 # Initialize Telethon client
 try:
-    client = TelegramClient(StringSession(SESSION), APP_ID, API_HASH)
+    # FloodWaits surface as errors so OUTBOUND can learn from them instead of Telethon sleeping silently
+    client = TelegramClient(StringSession(SESSION), APP_ID, API_HASH, flood_sleep_threshold=0)
 except Exception as ap:
     logging.error(f"Error initializing Telethon client: {ap}")
     exit(1)
 
 async def extract_terabox_links(message: Message) -> List[str]:
-    """Extract Terabox links from message text."""
-    if not message.text and not message.caption:
+    """Extract Terabox links from message entities, or its raw text without any."""
+    if not message.raw_text:
         return []
-        
-    # Get text and entities from message
-    text = message.text or message.caption
-    
-    # Handle bold/formatted text by getting raw text
-    if message.entities:
-        text = message.raw_text
-        
-    #pattern = r'(?:https?://(?:www\.)?(?:1024terabox\.com|terabox\.com|teraboxlink\.com|terafileshare\.com|teraboxshare\.com|teraboxapp\.com)/\S+)'
-    pattern = r'(?:https?://(?:www\.)?(?:1024terabox\.com|terabox\.com|teraboxlink\.com|terafileshare\.com|teraboxshare\.com|teraboxapp\.com|terasharelink\.com)/\S+)'
-    matches = re.finditer(pattern, text)
-    return [match.group(0) for match in matches]
+    return LINK_EXTRACTOR.extract(message)
 
 async def process_message(event: Message):
     """Queue incoming messages from source channel."""
     try:
-        # Add every message to queue immediately
-        await MESSAGE_QUEUE.put(event.message)
-        logger.info("Added new message to queue")
+        # Add every message to queue immediately once the catch-up is done
+        await LIVE_INGEST_OPEN.wait()
+        message = event.message
+        if message.grouped_id and not already_queued(message):
+            # Checked on arrival, messages queued while the album is buffered may pass its ids
+            ALBUMS.add((message.chat_id, message.grouped_id), message)
+        
+        # Album parts arrive back to back, so anything else from the chat completes a buffered album
+        for key in ALBUMS.keys():
+            if key[0] == message.chat_id and key[1] != message.grouped_id:
+                await ALBUMS.flush_now(key)
+        if not message.grouped_id and await enqueue_source_message(message):
+            logger.info("Added new message to queue")
     except Exception as e:
         logger.error(f"Error queueing message: {e}")
         logger.exception("Full traceback:")
 
+def high_water_mark(chat_id: int) -> Optional[int]:
+    """Id of the last source message of `chat_id` that is safely handled."""
+    value = STATE_DB.get_value(f"source_hwm:{chat_id}")
+    return int(value) if value is not None else None
+
+def advance_high_water_mark(chat_id: int, message_id: int):
+    # Compared inside SQLite, other processes may advance the same mark
+    STATE_DB.set_max_value(f"source_hwm:{chat_id}", message_id)
+
+def already_queued(message: Message) -> bool:
+    """Whether `message` is queued or handled already."""
+    return (
+        message.id <= (high_water_mark(message.chat_id) or 0)
+        or message.id in QUEUED_SOURCE_IDS[message.chat_id]
+    )
+
+def prune_queued_source_ids():
+    """Forget queued source ids the high-water mark covers, they stay behind when another process handled them."""
+    for chat_id in list(QUEUED_SOURCE_IDS):
+        hwm = high_water_mark(chat_id) or 0
+        ids = {message_id for message_id in QUEUED_SOURCE_IDS[chat_id] if message_id > hwm}
+        if ids:
+            QUEUED_SOURCE_IDS[chat_id] = ids
+        else:
+            del QUEUED_SOURCE_IDS[chat_id]
+
+async def enqueue_source_message(message: Message, force: bool = False) -> bool:
+    """Put a source message on MESSAGE_QUEUE unless it was queued or handled already.
+    
+    With a durable queue a message counts as handled once it is queued, with
+    the in-memory queue only once message_processor is done with it. Every
+    process watching the source sees the message, the queue keeps one copy.
+    """
+    return await enqueue_source_album([message], force)
+
+async def enqueue_source_album(messages: List[Message], force: bool = False) -> bool:
+    """Put the messages of one album on MESSAGE_QUEUE as a single item, see enqueue_source_message.
+    
+    The item is named after the album's lowest message id and lists all of
+    them under 'album', so the links of the album are extracted once.
+    """
+    chat_id = messages[0].chat_id
+    # Telegram may deliver a message twice
+    messages = list({message.id: message for message in messages if force or not already_queued(message)}.values())
+    if not messages:
+        return False
+    ids = sorted(message.id for message in messages)
+    item = {'chat_id': chat_id, 'message_id': ids[0]}
+    if len(ids) > 1:
+        item['album'] = ids
+    item_id = await MESSAGE_QUEUE.put(item, dedup_key=f"{chat_id}:{ids[0]}")
+    if item_id is None:
+        return False
+    QUEUED_SOURCE_IDS[chat_id].update(ids)
+    for message in messages if LIVE_MESSAGES_MAX > 0 else ():
+        # Messages another process handled are never taken out again, the oldest make room
+        while len(LIVE_MESSAGES) >= LIVE_MESSAGES_MAX:
+            LIVE_MESSAGES.pop(next(iter(LIVE_MESSAGES)))
+        LIVE_MESSAGES[(chat_id, message.id)] = message
+    if QUEUE_BACKEND != "memory":
+        advance_high_water_mark(chat_id, ids[-1])
+    if len(ids) > 1:
+        logger.info(f"Added album of {len(ids)} messages to queue")
+    return True
+
+async def backfill(chat_id: int, min_id: int, max_id: int = 0, limit: Optional[int] = None,
+                   force: bool = False) -> Tuple[int, int]:
+    """Queue source messages with min_id < id < max_id, oldest first.
+    
+    Telethon pages through the history 100 messages per request; the loop
+    pauses while MESSAGE_QUEUE holds more than BACKFILL_MAX_PENDING messages.
+    Consecutive messages of one album are queued as one item. Returns the
+    number of items queued and of messages read, which `limit` applies to.
+    """
+    queued = seen = 0
+    album: List[Message] = []
+    
+    async def flush() -> int:
+        nonlocal min_id
+        while MESSAGE_QUEUE.qsize() >= BACKFILL_MAX_PENDING:
+            await asyncio.sleep(0.5)
+        done = await enqueue_source_album(album, force=force)
+        min_id = album[-1].id
+        album.clear()
+        return int(done)
+    
+    while True:
+        try:
+            async for message in client.iter_messages(
+                chat_id, min_id=min_id, max_id=max_id, reverse=True,
+                limit=None if limit is None else limit - seen
+            ):
+                seen += 1
+                if album and not (message.grouped_id and message.grouped_id == album[0].grouped_id):
+                    queued += await flush()
+                album.append(message)
+            if album:
+                queued += await flush()
+            return queued, seen
+        except FloodWaitError as e:
+            # Resume after the last message queued, the album being collected is fetched again
+            seen -= len(album)
+            album.clear()
+            logger.warning(f"FloodWait of {e.seconds}s while backfilling {chat_id}, resuming after message {min_id}")
+            await asyncio.sleep(e.seconds)
+
+async def catch_up(chat_id: int):
+    """Queue everything posted in `chat_id` after the persisted high-water mark."""
+    try:
+        last_id = high_water_mark(chat_id)
+        if last_id is None:
+            # First start: remember where we are instead of replaying the whole history
+            latest = await OUTBOUND.call("fetch", client.get_messages, chat_id, limit=1, priority=PRIORITY_FETCH)
+            advance_high_water_mark(chat_id, latest[0].id if latest else 0)
+            logger.info(f"No high-water mark for {chat_id} yet, starting from the latest message")
+            return
+            
+        queued, seen = await backfill(chat_id, last_id, limit=BACKFILL_MAX_MESSAGES)
+        logger.info(f"Catch-up queued {queued} of {seen} message(s) posted in {chat_id} after message {last_id}")
+        # Albums and messages queued before are read but not queued again
+        if seen >= BACKFILL_MAX_MESSAGES:
+            logger.warning(f"Catch-up stopped at BACKFILL_MAX_MESSAGES ({BACKFILL_MAX_MESSAGES}), use /backfill for the rest")
+    except Exception as e:
+        logger.error(f"Error catching up on {chat_id}: {e}")
+
+async def catch_up_sources():
+    """Catch up on every routed source chat, then let live messages through."""
+    try:
+        for chat_id in ROUTER.sources:
+            await catch_up(chat_id)
+    finally:
+        LIVE_INGEST_OPEN.set()
+
+def split_seen_links(routed: Dict[str, List[int]]) -> Tuple[List[Tuple[str, str, List[int]]], List[Tuple[str, List[int]]]]:
+    """Split routed links into new (link, canonical key, destinations) and (key, destinations) handled before."""
+    new_links, duplicates, keys = [], [], set()
+    for link, destinations in routed.items():
+        key = canonical_link(link, LINK_EXTRACTOR.hosts) or link
+        if key in keys:
+            continue
+        keys.add(key)
+        if SEEN_LINKS.seen(key):
+            duplicates.append((key, destinations))
+        else:
+            new_links.append((link, key, destinations))
+    return new_links, duplicates
+
+async def load_source_message(chat_id: int, message_id: int) -> Optional[Message]:
+    """A queued source message, fetched again if it was queued before a restart or not kept in memory."""
+    message = LIVE_MESSAGES.pop((chat_id, message_id), None)
+    if message is None:
+        message = await OUTBOUND.call(
+            "fetch", client.get_messages, chat_id, ids=message_id, priority=PRIORITY_FETCH
+        )
+    return message
+
+async def load_source_album(chat_id: int, message_ids: List[int]) -> List[Message]:
+    """The still existing messages of a queued album, those not in memory fetched in one call."""
+    messages = {message_id: LIVE_MESSAGES.pop((chat_id, message_id), None) for message_id in message_ids}
+    missing = [message_id for message_id, message in messages.items() if message is None]
+    if missing:
+        fetched = await OUTBOUND.call(
+            "fetch", client.get_messages, chat_id, ids=missing, priority=PRIORITY_FETCH
+        )
+        messages.update((message.id, message) for message in fetched if message is not None)
+    return [message for message in messages.values() if message is not None]
+
 async def message_processor():
     """Process messages from MESSAGE_QUEUE and check for Terabox links."""
     while True:
+        item_id = None
         try:
             # Get message from queue
-            message = await MESSAGE_QUEUE.get()
+            item_id, item = await MESSAGE_QUEUE.get()
+            chat_id, album_ids = item['chat_id'], item.get('album') or [item['message_id']]
+            album = await load_source_album(chat_id, album_ids)
+            if not album:
+                logger.warning(f"Source message {item['message_id']} no longer exists, skipping")
+                MESSAGE_QUEUE.ack(item_id)
+                continue
             
-            # Extract links
-            terabox_links = await extract_terabox_links(message)
+            # The caption of an album sits on one of its messages, usually the first
+            message = next((part for part in album if part.raw_text), album[0])
+            cover = message if message.media else next((part for part in album if part.media), message)
             
-            if terabox_links:
-                logger.info(f"Found {len(terabox_links)} Terabox links in message")
+            # Extract links and split off the ones handled before
+            terabox_links, routed = [], {}
+            for part in album:
+                links = await extract_terabox_links(part)
+                terabox_links.extend(links)
+                for link, destinations in ROUTER.resolve(part.chat_id, part.raw_text, links).items():
+                    merged = routed.setdefault(link, [])
+                    merged.extend([destination for destination in destinations if destination not in merged])
+            new_links, duplicates = split_seen_links(routed)
+            
+            # A link handled for another source may still be new to this message's destinations
+            reposts, skipped = [], []
+            for key, destinations in duplicates:
+                added = SEEN_LINKS.add_destinations(key, destinations)
+                if DUPLICATE_MODE == "repost":
+                    added = destinations
+                if not added:
+                    skipped.append(key)
+                elif SEEN_LINKS.posts(key):
+                    reposts.append((key, added))
+                else:
+                    # Still in flight, the job posts to the added destinations as well
+                    logger.info(f"Routed in-flight link {key} to {added} as well")
+            if skipped:
+                logger.info(f"Skipping {len(skipped)} already handled link(s): {', '.join(skipped)}")
+            
+            if new_links or reposts:
+                logger.info(f"Found {len(new_links)} new and {len(reposts)} rerouted Terabox links in message")
                 
-                # Get thumbnail if available
+                # Get thumbnail if available (cover image only, not the full media), one per album
                 thumbnail = None
-                if message.media:
+                if cover.media:
                     try:
-                        thumbnail = await message.download_media(bytes)
-                        logger.info("Successfully saved thumbnail from source message")
+                        with TRACER.span(None, "thumbnail_download", chat_id=cover.chat_id, message_id=cover.id):
+                            thumbnail = await OUTBOUND.call(
+                                "fetch", download_thumbnail, cover, THUMB_TARGET_SIZE, THUMB_MAX_BYTES,
+                                priority=PRIORITY_FETCH
+                            )
+                        if thumbnail:
+                            logger.info(f"Saved {len(thumbnail)} byte thumbnail from source message")
+                            thumbnail = THUMBNAIL_STORE.put(thumbnail)
                     except Exception as e:
                         logger.error(f"Error saving thumbnail: {str(e)}")
                 
-                # Add each link separately to the queue with same thumbnail
-                for link in terabox_links:
-                    await LINK_QUEUE.put({
-                        'link': link,
-                        'text': message.text or message.caption or "",
-                        'thumbnail': thumbnail,
-                        'original_message': message
-                    })
-                    logger.info(f"Queued link for processing: {link}")
-            else:
+                # Duplicates go out again from their cached file store links
+                for key, destinations in reposts:
+                    for text in SEEN_LINKS.posts(key):
+                        for destination in destinations:
+                            await post_to_destination(destination, thumbnail, text)
+                    logger.info(f"Reposted cached file store link(s) for {key} to {destinations}")
+                
+                # With POST_COALESCE the file store links of all these links go out in one post
+                post_group = (cover.chat_id, cover.id)
+                if POST_COALESCE and new_links:
+                    POST_GROUPS.expect(post_group, [key for _, key, _ in new_links])
+                
+                # Add each link separately to the queue with the same thumbnail key
+                for link, key, destinations in new_links:
+                    SEEN_LINKS.add(key, destinations)
+                    trace_id = new_trace_id()
+                    # Waits while LINK_QUEUE is full, which in turn holds back MESSAGE_QUEUE
+                    item = await LINK_QUEUE.put(LinkRecord(
+                        link, key, message.text or "", thumbnail, destinations,
+                        cover.chat_id, cover.id, trace_id, time.time()
+                    ), dedup_key=key)
+                    if item is None:
+                        logger.info(f"Link is already queued, skipping: {link}")
+                        POST_GROUPS.finish(post_group, key)
+                        continue
+                    if message.date:
+                        # Source post to queued link, includes any time spent offline
+                        TRACER.record(trace_id, "ingest", time.time() - message.date.timestamp(),
+                                      chat_id=message.chat_id, message_id=message.id)
+                    logger.info(f"Queued link for processing: {link} [{trace_id}]")
+            elif not terabox_links:
                 logger.info("No Terabox links found in message, skipping")
+            elif not routed:
+                logger.info(f"No route from {message.chat_id} takes the links in this message, skipping")
             
-            MESSAGE_QUEUE.task_done()
+            MESSAGE_QUEUE.ack(item_id)
+            QUEUED_SOURCE_IDS[chat_id].difference_update(album_ids)
+            if QUEUE_BACKEND == "memory":
+                advance_high_water_mark(chat_id, album_ids[-1])
+            LAST_PROGRESS['messages'] = time.monotonic()
             
         except Exception as e:
             logger.error(f"Error in message processor: {e}")
+            COUNTERS.inc("bot_errors_total", where="message_processor")
+            if item_id is not None:
+                # Hand the message back instead of holding it until the next start
+                MESSAGE_QUEUE.nack(item_id, delay=RETRY_BASE_DELAY)
             await asyncio.sleep(1)
 
-async def process_queue():
-    """Process queued Terabox links."""
-    global CURRENT_PROCESSING
+async def restore_thumbnail(record: LinkRecord) -> Optional[str]:
+    """Thumbnail key of a queued link, downloaded again when this process does not hold it.
     
+    That happens after a restart or when another process queued the link.
+    """
+    key = record.thumbnail
+    if not key or key in THUMBNAIL_STORE:
+        return key
+    try:
+        with TRACER.span(record.trace_id, "thumbnail_restore"):
+            message = await load_source_message(record.chat_id, record.message_id)
+            thumbnail = message and await OUTBOUND.call(
+                "fetch", download_thumbnail, message, THUMB_TARGET_SIZE, THUMB_MAX_BYTES, priority=PRIORITY_FETCH
+            )
+        if thumbnail:
+            return THUMBNAIL_STORE.put(thumbnail)
+    except Exception as e:
+        logger.error(f"Error restoring thumbnail of {record.link}: {e}")
+    return None
+
+async def process_queue(worker_id: int = 1):
+    """Process queued Terabox links; LINK_WORKERS of these run side by side."""
     while True:
+        item_id = None
         try:
-            async with PROCESSING_LOCK:
-                if CURRENT_PROCESSING:
-                    await asyncio.sleep(1)
-                    continue
-                    
-                data = await LINK_QUEUE.get()
-                CURRENT_PROCESSING = data
-                link = data['link']
-                text = data['text']
-                thumbnail = data['thumbnail']
+            item_id, record = await LINK_QUEUE.get()
+            thumbnail = await restore_thumbnail(record)
+            job = LinkJob(
+                record.link, record.text, thumbnail, record.key,
+                destinations=list(record.destinations) or [DESTINATION_CHANNEL_ID],
+                trace_id=record.trace_id, post_group=(record.chat_id, record.message_id)
+            )
+            link = job.link
+            attempt = record.attempts + 1
+            if record.queued_at:
+                TRACER.record(job.trace_id, "queue_wait", time.time() - record.queued_at, attempt=attempt)
+            logger.info(f"Worker {worker_id} picked up link: {link} [{job.trace_id}] (attempt {attempt})")
+            timed_out = False
+            
+            try:
+                # Every stage has its own timeout, see stage_timeout
+                await process_single_link(job)
+                logger.info(f"Successfully processed link: {link} ({job.files_posted} file(s) posted)")
                 
-                try:
-                    # Process with timeout for complete operation
-                    await asyncio.wait_for(
-                        process_single_link(link, text, thumbnail),
-                        timeout=150  # 2.5 minutes timeout for complete operation
-                    )
-                    logger.info(f"Successfully processed link: {link}")
-                    # No fixed delay - proceed to next link immediately
-                    
-                except asyncio.TimeoutError:
-                    logger.error(f"Processing timeout for link: {link}")
-                    # Cleanup on timeout
-                    if link in LINK_THUMBNAIL_MAP:
-                        del LINK_THUMBNAIL_MAP[link]
-                    if link in PENDING_DOWNLOADS:
-                        del PENDING_DOWNLOADS[link]
-                    # Clean up any associated file store responses
-                    for msg_id, data in list(FILE_STORE_RESPONSES.items()):
-                        if data.get('original_link') == link:
-                            del FILE_STORE_RESPONSES[msg_id]
-                    
-                except Exception as e:
-                    logger.error(f"Error processing link {link}: {str(e)}")
-                    
-                finally:
-                    CURRENT_PROCESSING = None
-                    LINK_QUEUE.task_done()
+            except StageTimeout as e:
+                logger.error(f"Processing timeout for link: {link} ({e})")
+                # Only a silent downloader bot counts against the bot
+                timed_out = e.stage is JobState.SENT_TO_DOWNLOADER
+                job.fail(f"timeout in {e.stage.value}")
+                
+            except asyncio.TimeoutError:
+                logger.error(f"Timeout submitting link: {link}")
+                job.fail("timeout submitting")
+                
+            except Exception as e:
+                logger.error(f"Error processing link {link}: {str(e)}")
+                if not job.done:
+                    job.fail(str(e))
+                
+            finally:
+                # A cancelled worker leaves its item in flight, it is resumed on the next start
+                if job.downloader:
+                    DOWNLOADER_POOL.finished(job.downloader, job.downloader_latency, timed_out=timed_out)
+                cleanup_job(job)
+            
+            TRACER.record(
+                job.trace_id, "total", asyncio.get_event_loop().time() - job.created_at,
+                outcome=job.state.value, files=job.files_posted, attempt=attempt
+            )
+            if job.state is JobState.FAILED and not job.files_posted:
+                retried = retry_or_dead_letter(item_id, record, job)
+            else:
+                retried = False
+                LINK_QUEUE.ack(item_id)
+                COUNTERS.inc("bot_links_total", outcome="partial" if job.state is JobState.FAILED else "posted")
+            if not retried:
+                POST_GROUPS.finish(job.post_group, job.key)
+            LAST_PROGRESS['links'] = time.monotonic()
                     
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Queue processor error: {str(e)}")
+            COUNTERS.inc("bot_errors_total", where="queue_processor")
+            if item_id is not None:
+                # A no-op when the item was already acknowledged or put back
+                LINK_QUEUE.nack(item_id, delay=RETRY_BASE_DELAY)
             await asyncio.sleep(1)
 
-async def process_single_link(link: str, text: str, thumbnail: Optional[bytes] = None):
-    """Process a single link with all steps."""
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter: half the delay is fixed, half random."""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def retry_or_dead_letter(item_id: int, record: LinkRecord, job: LinkJob) -> bool:
+    """Put a failed link back on LINK_QUEUE after a backoff, or dead-letter it after LINK_MAX_ATTEMPTS.
+    
+    Returns whether the link is tried again.
+    """
+    attempts = record.attempts = record.attempts + 1
+    if attempts < LINK_MAX_ATTEMPTS:
+        delay = retry_delay(attempts)
+        record.queued_at = time.time() + delay
+        LINK_QUEUE.nack(item_id, delay=delay, payload=record)
+        COUNTERS.inc("bot_links_total", outcome="retried")
+        logger.warning(f"Retrying {job.link} in {delay:.0f}s after: {job.error}")
+        return True
+    
+    entry_id = DEAD_LETTERS.add(LINK_QUEUE.name, record, job.error, attempts)
+    LINK_QUEUE.ack(item_id)
+    COUNTERS.inc("bot_links_total", outcome="dead_lettered")
+    # Let the link through again the next time it shows up
+    SEEN_LINKS.forget(job.key)
+    logger.error(f"Dead-lettered {job.link} as #{entry_id} after {attempts} attempt(s): {job.error}")
+    return False
+
+def stage_timeout(job: LinkJob) -> float:
+    """Seconds `job` may stay in its current stage, from the latencies the bots showed lately."""
+    samples = ()
+    if job.state is JobState.SENT_TO_DOWNLOADER:
+        stats = DOWNLOADER_POOL.bots.get(job.downloader)
+        samples = stats.latencies if stats else ()
+    elif job.state is JobState.FORWARDED_TO_STORE:
+        samples = FILE_STORE_LATENCIES
+    if len(samples) < STAGE_TIMEOUT_SAMPLES:
+        return LINK_TIMEOUT
+    return min(LINK_TIMEOUT, max(STAGE_TIMEOUT_MIN, percentile_of(samples, 95) * STAGE_TIMEOUT_FACTOR))
+
+def correlation_expired(job: LinkJob, kind: str):
+    """A bot never answered a tracked message; fail the job so process_queue retries it."""
+    if job.done or job.id not in PENDING_DOWNLOADS:
+        return
+    if kind == "forwarded":
+        job.fail("forwarded message expired unanswered")
+    elif job.state is JobState.SENT_TO_DOWNLOADER:
+        # Counts against the downloader bot like its stage timeout, which the wheel may beat by a tick
+        job.fail("sent message expired unanswered", StageTimeout(job.state, CORRELATION_INDEX.ttl))
+
+def cleanup_job(job: LinkJob):
+    """Drop all tracking state that belongs to a finished job."""
+    PENDING_DOWNLOADS.pop(job.id, None)
+    CORRELATION_INDEX.discard_job(job)
+
+async def process_single_link(job: LinkJob):
+    """Process a single link with all steps and wait until it is posted."""
+    link = job.link
     try:
-        if thumbnail:
-            LINK_THUMBNAIL_MAP[link] = thumbnail
-            logger.info(f"Mapped thumbnail to Terabox link: {link}")
+        PENDING_DOWNLOADS[job.id] = job
         
-        # Send only the link to downloader bot
-        sent_msg = await client.send_message(
-            DOWNLOADER_BOT_USERNAME,
-            link  # Only send the link, not the full caption
-        )
+        # Send only the link to the least busy healthy downloader bot
+        downloader = DOWNLOADER_POOL.pick()
+        with TRACER.span(job.trace_id, "submit", bot=downloader):
+            sent_msg = await asyncio.wait_for(
+                OUTBOUND.call(
+                    downloader,
+                    client.send_message,
+                    downloader,
+                    link,  # Only send the link, not the full caption
+                    priority=PRIORITY_SUBMIT
+                ),
+                timeout=LINK_TIMEOUT
+            )
         
         if sent_msg:
-            # Store message ID and link mapping for tracking
-            FILE_STORE_RESPONSES[sent_msg.id] = {
-                'original_link': link,
-                'last_message_time': asyncio.get_event_loop().time(),
-                'original_text': text  # Store original text for later use
-            }
-            logger.info(f"Sent to downloader bot, tracking message ID: {sent_msg.id}")
+            # Store message ID and job mapping for tracking
+            job.sent_to_downloader(downloader)
+            DOWNLOADER_POOL.started(downloader)
+            CORRELATION_INDEX.track_sent(sent_msg.id, job)
+            logger.info(f"Sent to downloader bot @{downloader}, tracking message ID: {sent_msg.id}")
             
-            # Create and wait for download event
-            download_event = asyncio.Event()
-            PENDING_DOWNLOADS[link] = download_event
-            await download_event.wait()
+            # Handlers advance the job; it completes once every file is posted
+            await job.wait_done(LINK_SETTLE_SECONDS, stage_timeout)
+        else:
+            raise RuntimeError("Downloader bot message was not sent")
             
     except Exception as e:
         logger.error(f"Error in process_single_link: {str(e)}")
         raise
 
+async def post_to_destination(entity, thumbnail: Optional[str], text: str, trace_id: Optional[str] = None):
+    """Post a file store link under its thumbnail, or as plain text without one."""
+    try:
+        # Send the original thumbnail with file store link as caption
+        if await send_thumbnail_post(entity, thumbnail, text, trace_id):
+            logger.info("Successfully sent original thumbnail with file store link")
+            return
+    except Exception as e:
+        logger.error(f"Error sending to destination: {str(e)}")
+        
+    # If no thumbnail found or it failed, send just the message
+    await OUTBOUND.call(
+        entity,
+        client.send_message,
+        entity,
+        text,
+        parse_mode='html',
+        priority=PRIORITY_POST
+    )
+    logger.info("Sent file store link (no thumbnail available)")
+
+async def send_thumbnail_post(entity, thumbnail: Optional[str], caption: str,
+                              trace_id: Optional[str] = None) -> bool:
+    """Post `caption` under the thumbnail stored as `thumbnail`, straight from memory.
+
+    The photo Telegram returns for the first post of an image is cached by
+    content hash, so other links sharing that image never upload it again.
+    Returns False when there is no thumbnail to send.
+    """
+    if not thumbnail:
+        return False
+        
+    try:
+        async with UPLOAD_CACHE.lock(thumbnail):
+            photo = UPLOAD_CACHE.get(thumbnail)
+            if photo is not None:
+                try:
+                    await OUTBOUND.call(
+                        entity, client.send_file, entity, photo,
+                        caption=caption, parse_mode='html', force_document=False, priority=PRIORITY_POST
+                    )
+                    return True
+                except Exception as e:
+                    # File references expire; upload the bytes again below
+                    logger.warning(f"Cached thumbnail upload could not be reused: {e}")
+                    UPLOAD_CACHE.discard(thumbnail)
+                    
+            source = THUMBNAIL_STORE.open(thumbnail)
+            if source is None:
+                return False
+            with source, TRACER.span(trace_id, "upload"):
+                uploaded = await OUTBOUND.call(
+                    "upload", client.upload_file, source, file_name=source.name, priority=PRIORITY_POST
+                )
+            UPLOAD_CACHE.uploads += 1
+            sent = await OUTBOUND.call(
+                entity, client.send_file, entity, uploaded,
+                caption=caption, parse_mode='html', force_document=False, priority=PRIORITY_POST
+            )
+            if sent and sent.photo:
+                UPLOAD_CACHE.put(thumbnail, sent.photo)
+            return True
+    finally:
+        UPLOAD_CACHE.release(thumbnail)
+
+def reply_to_id(event: Message) -> Optional[int]:
+    """Id of the message `event` replies to, if any."""
+    return event.reply_to.reply_to_msg_id if event.reply_to else None
+
+def file_name(message: Message) -> Optional[str]:
+    return message.file.name if message.file else None
+
+def reply_text(event: Message) -> str:
+    """File name and caption of a bot message, what bots that do not reply are matched by."""
+    return " ".join(filter(None, (file_name(event), event.raw_text)))
+
 async def handle_downloader_response(event: Message):
-    """Handle responses from the downloader bot."""
+    """Handle responses from the downloader bots."""
     try:
         # Check if the message has media and is allowed type
         if event.media and is_allowed_media(event):
-            # Forward to file store bot
-            forwarded = await event.forward_to(FILE_STORE_BOT_USERNAME)
-            if forwarded:
-                logger.info(f"Forwarded file to file store bot with ID: {forwarded.id}")
-                
-                # Transfer the tracking data to new message ID
-                if event.reply_to and event.reply_to.reply_to_msg_id in FILE_STORE_RESPONSES:
-                    original_data = FILE_STORE_RESPONSES[event.reply_to.reply_to_msg_id]
-                    FILE_STORE_RESPONSES[forwarded.id] = {
-                        'original_link': original_data['original_link'],
-                        'last_message_time': asyncio.get_event_loop().time()
-                    }
-            else:
-                logger.error("Failed to forward to file store bot")
+            # Find the job this file belongs to
+            sender = await OUTBOUND.call("fetch", event.get_sender, priority=PRIORITY_FETCH)
+            downloader = normalize_username(getattr(sender, 'username', None) or "")
+            job = CORRELATION_INDEX.match_downloader_reply(reply_to_id(event), downloader, reply_text(event))
+            if not job:
+                # Its file store link would match no job either, or worse the oldest forwarded file of another
+                logger.warning(f"Downloader file {event.id} does not belong to any pending link, dropping it")
+                return
+            job.file_received()
+            if job.files_received == 1 and job.downloader_latency is not None:
+                TRACER.record(job.trace_id, "downloader", job.downloader_latency, bot=job.downloader)
+            
+            # Forwarded to the file store bot together with the other files of this link
+            FORWARD_BATCHER.add((event.chat_id, job.id), (event.id, job))
         else:
             logger.info("Skipping non-allowed media type or sticker")
 
     except Exception as e:
         logger.error(f"Error handling downloader response: {str(e)}")
+        COUNTERS.inc("bot_errors_total", where="downloader_handler")
+
+async def forward_to_file_store(key: Tuple[int, int], files: List[Tuple[int, LinkJob]]):
+    """Forward a batch of downloader files of one link with a single call and track each copy."""
+    from_peer = key[0]
+    job = files[0][1]
+    ids = [msg_id for msg_id, _ in files]
+    if job.id not in PENDING_DOWNLOADS:
+        # The job failed or finished while the batch was collected, a retry gets files of its own
+        logger.warning(f"Not forwarding {len(ids)} file(s) of finished job #{job.id} ({job.link})")
+        return
+    try:
+        with TRACER.span(job.trace_id, "forward", files=len(ids)):
+            forwarded = await OUTBOUND.call(
+                FILE_STORE_BOT, client.forward_messages, FILE_STORE_BOT, ids, from_peer, priority=PRIORITY_FORWARD
+            )
+    except Exception as e:
+        logger.error(f"Error forwarding {len(ids)} file(s) to file store bot: {str(e)}")
+        COUNTERS.inc("bot_errors_total", where="forward")
+        forwarded = []
+    
+    # One result per id in the order sent, None for a message that was not forwarded
+    forwarded = list(forwarded or [])
+    forwarded += [None] * (len(ids) - len(forwarded))
+    for (msg_id, job), copy in zip(files, forwarded):
+        if copy:
+            logger.info(f"Forwarded file {msg_id} to file store bot with ID: {copy.id}")
+            # Transfer the tracking data to new message ID, unless the job ended during the call
+            if job.id in PENDING_DOWNLOADS:
+                job.file_forwarded()
+                CORRELATION_INDEX.track_forwarded(copy.id, job, file_name(copy))
+        else:
+            logger.error(f"Failed to forward file {msg_id} to file store bot")
+            job.file_dropped()
 
 '''async def handle_file_store_response(event: Message):
     """Handle responses from the file store bot."""
@@ -348,95 +946,116 @@ async def handle_downloader_response(event: Message):
         logger.error(f"Error handling file store response: {str(e)}")
         logger.exception("Full traceback:")'''
 
+def job_destinations(job: LinkJob) -> List[int]:
+    """Destinations of `job`, plus any other source routed the same link to since it was queued."""
+    destinations = list(job.destinations)
+    destinations.extend(chat_id for chat_id in SEEN_LINKS.destinations(job.key) if chat_id not in destinations)
+    return destinations
+
 async def handle_file_store_response(event: Message):
     """Handle responses from the file store bot."""
     try:
-        # Get message text/caption
-        file_store_message = event.message.text or event.message.caption
+        # Telethon keeps the caption of a media message in .text as well
+        file_store_message = event.message.text
         
         # Check if this is a file store link message
         if file_store_message and "🖇️ Link:" in file_store_message:
-            # Find the most recent pending file store response
-            current_time = asyncio.get_event_loop().time()
-            recent_response = None
-            recent_id = None
-            
-            # Find the most recent pending response within last 60 seconds
-            for msg_id, data in FILE_STORE_RESPONSES.items():
-                if current_time - data['last_message_time'] < 60:  # Within last 60 seconds
-                    if not recent_response or data['last_message_time'] > FILE_STORE_RESPONSES[recent_id]['last_message_time']:
-                        recent_response = data
-                        recent_id = msg_id
-            
-            if recent_response:
-                try:
-                    # Get the original thumbnail for this link
-                    original_link = recent_response.get('original_link')
-                    if original_link and original_link in LINK_THUMBNAIL_MAP:
-                        thumbnail_data = LINK_THUMBNAIL_MAP[original_link]
-                        logger.info(f"Found saved thumbnail for link: {original_link}")
-                        
-                        # Create temporary file for the saved thumbnail
-                        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_thumb:
-                            temp_thumb.write(thumbnail_data)
-                            temp_thumb.flush()
-                            
-                            # Send the saved thumbnail with file store link as caption
-                            await client.send_file(
-                                entity=DESTINATION_CHANNEL_ID,
-                                file=temp_thumb.name,
-                                caption=file_store_message,
-                                parse_mode='html',
-                                force_document=False
-                            )
-                            logger.info("Successfully sent original thumbnail with file store link")
-                            
-                            # Cleanup
-                            os.unlink(temp_thumb.name)
-                            del LINK_THUMBNAIL_MAP[original_link]
-                    else:
-                        # If no thumbnail found, send just the message
-                        await client.send_message(
-                            DESTINATION_CHANNEL_ID,
-                            file_store_message,
-                            parse_mode='html'
-                        )
-                        logger.info("Sent file store link (no thumbnail available)")
-                    
-                    # Cleanup tracking data
-                    if recent_id in FILE_STORE_RESPONSES:
-                        del FILE_STORE_RESPONSES[recent_id]
-                    
-                except Exception as e:
-                    logger.error(f"Error sending to destination: {str(e)}")
-                    # Fallback: send just the message
-                    await client.send_message(
-                        DESTINATION_CHANNEL_ID,
-                        file_store_message,
-                        parse_mode='html'
-                    )
+            # Find the forwarded file this link was generated for
+            job = CORRELATION_INDEX.match_file_store_reply(reply_to_id(event), file_store_message)
+            if job and job.id not in PENDING_DOWNLOADS:
+                logger.warning(f"Ignoring file store link of finished job #{job.id} ({job.link})")
+            elif job:
+                job.link_received()
+                if job.store_latency is not None:
+                    FILE_STORE_LATENCIES.append(job.store_latency)
+                    TRACER.record(job.trace_id, "file_store", job.store_latency)
+                destinations = job_destinations(job)
+                if POST_GROUPS.add(job.post_group, (destinations, job.thumbnail, file_store_message, job.trace_id)):
+                    logger.info(f"Holding file store link of {job.link} for the combined post of its source message")
+                else:
+                    for destination in destinations:
+                        with TRACER.span(job.trace_id, "post", destination=destination):
+                            await post_to_destination(destination, job.thumbnail, file_store_message, job.trace_id)
+                        COUNTERS.inc("bot_posts_total")
+                SEEN_LINKS.record_post(job.key, file_store_message)
+                job.posted()
             else:
-                logger.warning("No recent file store response found to process")
+                logger.warning("No pending forwarded file matches this file store link")
                 
     except Exception as e:
         logger.error(f"Error handling file store response: {str(e)}")
+        COUNTERS.inc("bot_errors_total", where="file_store_handler")
         logger.exception("Full traceback:")
 
 
+def join_captions(texts: List[str], limit: int) -> List[str]:
+    """`texts` joined by blank lines into as few chunks of at most `limit` characters as they fit in."""
+    chunks = []
+    for text in texts:
+        if chunks and len(chunks[-1]) + 2 + len(text) <= limit:
+            chunks[-1] += "\n\n" + text
+        else:
+            chunks.append(text)
+    return chunks
+
+async def publish_post_group(group: Tuple[int, int], posts: List[Tuple[List[int], Optional[str], str, str]]):
+    """Post the file store links of one source message to each destination as one combined post.
+    
+    The cover image carries as many links as fit in its caption; any links
+    beyond that follow as text messages.
+    """
+    by_destination: Dict[int, List[str]] = {}
+    thumbnail = next((thumbnail for _, thumbnail, _, _ in posts if thumbnail), None)
+    trace_id = posts[0][3]
+    for destinations, _, text, _ in posts:
+        for destination in destinations:
+            by_destination.setdefault(destination, []).append(text)
+    
+    for destination, texts in by_destination.items():
+        chunks = join_captions(texts, CAPTION_MAX_LENGTH if thumbnail else MESSAGE_MAX_LENGTH)
+        try:
+            with TRACER.span(trace_id, "post", destination=destination, links=len(texts)):
+                await post_to_destination(destination, thumbnail, chunks[0], trace_id)
+                for chunk in join_captions(chunks[1:], MESSAGE_MAX_LENGTH):
+                    await OUTBOUND.call(
+                        destination, client.send_message, destination, chunk, parse_mode='html', priority=PRIORITY_POST
+                    )
+            COUNTERS.inc("bot_posts_total", len(texts))
+            logger.info(f"Posted {len(texts)} file store link(s) of source message {group[1]} to {destination}")
+        except Exception as e:
+            logger.error(f"Error posting combined links of source message {group[1]} to {destination}: {str(e)}")
+            COUNTERS.inc("bot_errors_total", where="combined_post")
+
+
+async def reply(event: Message, text: str):
+    """Answer an admin command; FloodWaits are waited out like for every other call."""
+    await OUTBOUND.call(event.chat_id, event.reply, text, priority=PRIORITY_POST)
+
+
 @client.on(events.NewMessage(pattern='/start'))
 async def start_command(event: Message):
     """Handle /start command."""
     if event.sender_id != YOUR_ADMIN_USER_ID:
         return
         
-    await event.reply(
+    await reply(
+        event,
         "Bot is running!\n\n"
         "Available commands:\n"
         "/set_source <channel_id>\n"
         "/set_destination <channel_id>\n"
-        "/set_downloader_bot <username>\n"
+        "/set_downloader_bot <username> [<username> ...]\n"
         "/set_file_store_bot <username>\n"
-        "/get_config"
+        "/set_hosts <host> [<host> ...]\n"
+        "/set_routes <json list>\n"
+        "/reload\n"
+        "/backfill <from_id> <to_id> [<source_id>]\n"
+        "/get_config\n"
+        "/routes\n"
+        "/dead_letters\n"
+        "/replay_dead <id|all>\n"
+        "/purge_dead <id|all>\n"
+        "/stats"
     )
 
 @client.on(events.NewMessage(pattern=r'/set_source (.+)'))
@@ -446,8 +1065,10 @@ async def set_source(event: Message):
         return
         
     channel_id = event.pattern_match.group(1)
-    config_manager.update_config('source_channel', channel_id)
-    await event.reply(f"Source channel updated to: {channel_id}")
+    if config_manager.data.get("routes"):
+        await reply(event, "config.json has a routes table, change it with /set_routes instead")
+        return
+    await reconfigure(event, {'source_channel': int(channel_id)}, f"Source channel updated to: {channel_id}")
 
 @client.on(events.NewMessage(pattern=r'/set_destination (.+)'))
 async def set_destination(event: Message):
@@ -456,18 +1077,22 @@ async def set_destination(event: Message):
         return
         
     channel_id = event.pattern_match.group(1)
-    config_manager.update_config('destination_channel', channel_id)
-    await event.reply(f"Destination channel updated to: {channel_id}")
+    if config_manager.data.get("routes"):
+        await reply(event, "config.json has a routes table, change it with /set_routes instead")
+        return
+    await reconfigure(event, {'destination_channel': int(channel_id)}, f"Destination channel updated to: {channel_id}")
 
 @client.on(events.NewMessage(pattern=r'/set_downloader_bot (.+)'))
 async def set_downloader_bot(event: Message):
-    """Set downloader bot username."""
+    """Set downloader bot username(s), several separated by spaces form a pool."""
     if event.sender_id != YOUR_ADMIN_USER_ID:
         return
         
-    username = event.pattern_match.group(1)
-    config_manager.update_config('downloader_bot', username)
-    await event.reply(f"Downloader bot updated to: {username}")
+    usernames = event.pattern_match.group(1).split()
+    await reconfigure(
+        event, {'downloader_bot': usernames[0], 'downloader_bots': usernames},
+        f"Downloader bot(s) updated to: {', '.join(usernames)}"
+    )
 
 @client.on(events.NewMessage(pattern=r'/set_file_store_bot (.+)'))
 async def set_file_store_bot(event: Message):
@@ -475,9 +1100,66 @@ async def set_file_store_bot(event: Message):
     if event.sender_id != YOUR_ADMIN_USER_ID:
         return
         
-    username = event.pattern_match.group(1)
-    config_manager.update_config('file_store_bot', username)
-    await event.reply(f"File store bot updated to: {username}")
+    username = event.pattern_match.group(1).strip()
+    await reconfigure(event, {'file_store_bot': username}, f"File store bot updated to: {username}")
+
+@client.on(events.NewMessage(pattern=r'/set_hosts (.+)'))
+async def set_hosts(event: Message):
+    """Set the hosts links are extracted for."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    hosts = sorted({host.lower() for host in event.pattern_match.group(1).split()})
+    await reconfigure(event, {'link_hosts': hosts}, f"Link hosts updated to: {', '.join(hosts)}")
+
+@client.on(events.NewMessage(pattern=r'/set_routes (.+)'))
+async def set_routes(event: Message):
+    """Replace the routing table with a JSON list of routes."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    try:
+        routes = json.loads(event.pattern_match.group(1))
+    except ValueError as e:
+        await reply(event, f"Routes must be a JSON list: {e}")
+        return
+    await reconfigure(event, {'routes': routes}, f"Routes updated, {len(routes)} route(s) active")
+
+@client.on(events.NewMessage(pattern='/reload'))
+async def reload_config(event: Message):
+    """Apply config.json after it was edited by hand."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        await reply(event, f"Cannot read {CONFIG_FILE}: {e}")
+        return
+    async with CONFIG_LOCK:
+        try:
+            await apply_config(data)
+        except Exception as e:
+            await reply(event, f"Configuration not changed: {e}")
+            return
+        config_manager.data = data
+    await reply(event, f"Reloaded {CONFIG_FILE}")
+
+@client.on(events.NewMessage(pattern=r'/backfill (\d+) (\d+)(?: (-?\d+))?'))
+async def backfill_range(event: Message):
+    """Queue source messages from_id..to_id (inclusive) again, from the first routed source by default."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    from_id, to_id = int(event.pattern_match.group(1)), int(event.pattern_match.group(2))
+    chat_id = int(event.pattern_match.group(3) or ROUTER.sources[0])
+    if not ROUTER.routes_for(chat_id):
+        await reply(event, f"No route starts at {chat_id}")
+        return
+    await reply(event, f"Backfilling messages {from_id}..{to_id} from {chat_id}")
+    queued, seen = await backfill(chat_id, from_id - 1, to_id + 1, force=True)
+    await reply(event, f"Backfill queued {queued} item(s) from {seen} message(s)")
 
 @client.on(events.NewMessage(pattern='/get_config'))
 async def get_config(event: Message):
@@ -486,35 +1168,275 @@ async def get_config(event: Message):
         return
         
     config_text = json.dumps(config_manager.data, indent=2)
-    await event.reply(f"Current configuration:\n```\n{config_text}\n```")
+    await reply(event, f"Current configuration:\n```\n{config_text}\n```")
+
+@client.on(events.NewMessage(pattern='/routes'))
+async def get_routes(event: Message):
+    """Show the compiled routing table."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    routes_text = json.dumps([route.to_dict() for route in ROUTER.routes], indent=2)
+    await reply(event, f"Current routes:\n```\n{routes_text}\n```")
+
+@client.on(events.NewMessage(pattern='/dead_letters'))
+async def list_dead_letters(event: Message):
+    """Show the newest dead-lettered links."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    entries = DEAD_LETTERS.entries()
+    if not entries:
+        await reply(event, "No dead letters")
+        return
+    lines = [
+        f"#{entry['id']} {entry['payload'].get('link')} ({entry['attempts']} attempt(s)): {entry['error']}"
+        for entry in entries
+    ]
+    await reply(event, f"Dead letters ({len(DEAD_LETTERS)} total, newest first):\n" + "\n".join(lines))
+
+@client.on(events.NewMessage(pattern=r'/replay_dead (\d+|all)'))
+async def replay_dead_letters(event: Message):
+    """Queue dead-lettered links again with a fresh attempt count."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    target = event.pattern_match.group(1)
+    replayed = 0
+    for entry in DEAD_LETTERS.take(None if target == "all" else int(target)):
+        record = LinkRecord.from_dict(entry['payload'])
+        record.attempts, record.queued_at = 0, time.time()
+        SEEN_LINKS.add(record.key, record.destinations)
+        if await LINK_QUEUE.put(record, dedup_key=record.key) is not None:
+            replayed += 1
+    await reply(event, f"Replayed {replayed} dead-lettered link(s)")
+
+@client.on(events.NewMessage(pattern=r'/purge_dead (\d+|all)'))
+async def purge_dead_letters(event: Message):
+    """Drop dead-lettered links for good."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    target = event.pattern_match.group(1)
+    purged = DEAD_LETTERS.take(None if target == "all" else int(target))
+    await reply(event, f"Purged {len(purged)} dead-lettered link(s)")
+
+@client.on(events.NewMessage(pattern='/stats'))
+async def get_stats(event: Message):
+    """Show queue sizes, in-flight jobs and thumbnail cache counters."""
+    if event.sender_id != YOUR_ADMIN_USER_ID:
+        return
+        
+    stats = {
+        'worker': WORKER_ID,
+        'message_queue': MESSAGE_QUEUE.qsize(),
+        'link_queue': LINK_QUEUE.qsize(),
+        'in_flight': len(PENDING_DOWNLOADS),
+        'queued_in_flight': MESSAGE_QUEUE.in_flight() + LINK_QUEUE.in_flight(),
+        'correlation_entries': CORRELATION_INDEX.stats(),
+        'timers': TIMERS.stats(),
+        'thumbnails': THUMBNAIL_STORE.stats(),
+        'thumbnail_uploads': UPLOAD_CACHE.stats(),
+        'downloaders': DOWNLOADER_POOL.stats(),
+        'outbound': {'waiting': OUTBOUND.waiting(), 'peers': OUTBOUND.stats()},
+        'forward_batches': {'waiting': len(FORWARD_BATCHER), 'batches': FORWARD_BATCHER.batches,
+                            'files': FORWARD_BATCHER.items},
+        'seen_links': {'hits': SEEN_LINKS.hits, 'misses': SEEN_LINKS.misses},
+        'retrying': LINK_QUEUE.delayed(),
+        'live_messages': len(LIVE_MESSAGES),
+        'post_groups': {'open': len(POST_GROUPS), 'published': POST_GROUPS.published},
+        'dead_letters': len(DEAD_LETTERS),
+        'file_store_latency_p95': percentile_of(FILE_STORE_LATENCIES, 95),
+        'stages': TRACER.stats(),
+    }
+    stats_text = json.dumps(stats, indent=2)
+    text = f"Current stats:\n```\n{stats_text}\n```"
+    if len(text) <= MESSAGE_MAX_LENGTH:
+        await reply(event, text)
+        return
+    # With many peers or stages the stats do not fit in a message, send them as a file
+    await OUTBOUND.call(
+        event.chat_id, event.reply, "Current stats:", file=stats_text.encode(), force_document=True,
+        attributes=[DocumentAttributeFilename("stats.json")], priority=PRIORITY_POST
+    )
+
+async def apply_config(data: dict):
+    """Build routing, bots and handler filters from `data`, then swap them all in at once.
+    
+    Usernames are resolved before anything changes, so a configuration that
+    does not work leaves the running one untouched. Jobs already in flight
+    keep their destinations, and replies from bots that were just removed
+    are still accepted for LINK_TIMEOUT seconds.
+    """
+    global LINK_EXTRACTOR, ROUTER, FILE_STORE_BOT
+    data = routing_config(data)
+    extractor = LinkExtractor(data.get("link_hosts") or TERABOX_HOSTS)
+    router = Router.from_config(data)
+    downloaders = configured_downloader_bots(data)
+    file_store_bot = data.get("file_store_bot") or FILE_STORE_BOT_USERNAME
+    # Resolving a username can hit a FloodWait, the client no longer sleeps through those itself
+    downloader_ids = [
+        await OUTBOUND.call("fetch", client.get_peer_id, username, priority=PRIORITY_FETCH)
+        for username in downloaders
+    ]
+    file_store_id = await OUTBOUND.call("fetch", client.get_peer_id, file_store_bot, priority=PRIORITY_FETCH)
+    new_sources = set(router.sources) - SOURCE_FILTER.ids
+    
+    # No awaits from here on: handlers see either the old or the new configuration
+    LINK_EXTRACTOR, ROUTER, FILE_STORE_BOT = extractor, router, file_store_bot
+    DOWNLOADER_POOL.set_bots(downloaders)
+    for destination in router.destinations:
+        if str(destination) not in OUTBOUND.buckets:
+            OUTBOUND.set_rate(destination, DESTINATION_POST_RATE)
+    SOURCE_FILTER.replace(router.sources)
+    DOWNLOADER_FILTER.replace(downloader_ids, drain=LINK_TIMEOUT)
+    FILE_STORE_FILTER.replace([file_store_id], drain=LINK_TIMEOUT)
+    logger.info(
+        f"Configuration applied: {len(router.routes)} route(s), {len(router.sources)} source(s), "
+        f"downloaders {', '.join(DOWNLOADER_POOL.usernames)}, file store @{normalize_username(file_store_bot)}"
+    )
+    
+    # Sources added at runtime start from their latest message
+    if LIVE_INGEST_OPEN.is_set():
+        for chat_id in new_sources:
+            asyncio.create_task(catch_up(chat_id))
 
-# Register event handlers
+async def reconfigure(event: Message, changes: Dict[str, Any], done_text: str):
+    """Apply `changes` to the running bot, then persist them to config.json."""
+    async with CONFIG_LOCK:
+        try:
+            await apply_config({**config_manager.data, **changes})
+        except Exception as e:
+            await reply(event, f"Configuration not changed: {e}")
+            return
+        await config_manager.update_config(changes)
+    await reply(event, done_text)
+
+# Register event handlers; their filters follow apply_config, so they stay registered
 client.add_event_handler(
     process_message,
-    events.NewMessage(chats=SOURCE_CHANNEL_ID)
+    events.NewMessage(func=lambda e: e.chat_id in SOURCE_FILTER)
 )
 
 client.add_event_handler(
     handle_downloader_response,
-    events.NewMessage(from_users=DOWNLOADER_BOT_USERNAME)
+    events.NewMessage(incoming=True, func=lambda e: e.sender_id in DOWNLOADER_FILTER)
 )
 
 client.add_event_handler(
     handle_file_store_response,
-    events.NewMessage(from_users=FILE_STORE_BOT_USERNAME)
+    events.NewMessage(incoming=True, func=lambda e: e.sender_id in FILE_STORE_FILTER)
 )
 
+def health_checks() -> Tuple[bool, Dict[str, bool]]:
+    """Whether the client is connected, the workers run and no queue is stuck."""
+    now = time.monotonic()
+    checks = {
+        'client_connected': client.is_connected(),
+        'workers_alive': bool(WORKER_TASKS) and not any(task.done() for task in WORKER_TASKS.values()),
+    }
+    for name, queue in (("messages", MESSAGE_QUEUE), ("links", LINK_QUEUE)):
+        checks[f'{name}_queue_moving'] = not (
+            queue.qsize() and now - LAST_PROGRESS[name] > HEALTH_STALL_SECONDS
+        )
+    return all(checks.values()), checks
+
+def render_metrics() -> str:
+    """Current pipeline state in the Prometheus text format."""
+    queues = (MESSAGE_QUEUE, LINK_QUEUE)
+    stage_latency = []
+    for username, bot in DOWNLOADER_POOL.bots.items():
+        for quantile in (50, 90, 95):
+            labels = {'stage': "downloader", 'bot': username, 'quantile': str(quantile / 100)}
+            stage_latency.append((labels, bot.latency_percentile(quantile)))
+    for quantile in (50, 90, 95):
+        labels = {'stage': "file_store", 'bot': normalize_username(FILE_STORE_BOT), 'quantile': str(quantile / 100)}
+        stage_latency.append((labels, percentile_of(FILE_STORE_LATENCIES, quantile)))
+    thumbnails = THUMBNAIL_STORE.stats()
+    stage_seconds = [
+        ({'stage': stage, 'quantile': str(quantile / 100)}, histogram.percentile(quantile))
+        for stage, histogram in TRACER.histograms.items() for quantile in (50, 90, 99)
+    ]
+    return format_metrics([
+        ("bot_queue_ready", "gauge", "Queue items waiting for a worker",
+         [({'queue': queue.name}, queue.qsize()) for queue in queues]),
+        ("bot_queue_in_flight", "gauge", "Queue items handed to a worker and not acknowledged",
+         [({'queue': queue.name}, queue.in_flight()) for queue in queues]),
+        ("bot_queue_delayed", "gauge", "Queue items waiting for their retry delay",
+         [({'queue': queue.name}, queue.delayed()) for queue in queues]),
+        ("bot_jobs_in_flight", "gauge", "Links this process is working on", [({}, len(PENDING_DOWNLOADS))]),
+        ("bot_dead_letters", "gauge", "Links parked in the dead-letter queue", [({}, len(DEAD_LETTERS))]),
+        ("bot_stage_latency_seconds", "gauge", "Recent latency percentiles of the bot stages", stage_latency),
+        ("bot_downloader_outstanding", "gauge", "Links waiting on each downloader bot",
+         [({'bot': username}, bot.outstanding) for username, bot in DOWNLOADER_POOL.bots.items()]),
+        ("bot_outbound_waiting", "gauge", "Outbound calls waiting for rate limit budget", [({}, OUTBOUND.waiting())]),
+        ("bot_forward_waiting", "gauge", "Downloader files collected for the next forward", [({}, len(FORWARD_BATCHER))]),
+        ("bot_post_groups_open", "gauge", "Source messages whose combined post is still collecting links",
+         [({}, len(POST_GROUPS))]),
+        ("bot_forward_batches_total", "counter", "Forward calls to the file store bot", [({}, FORWARD_BATCHER.batches)]),
+        ("bot_forwarded_files_total", "counter", "Files handed to those forward calls", [({}, FORWARD_BATCHER.items)]),
+        ("bot_flood_waits_total", "counter", "FloodWait errors per peer",
+         [({'peer': peer}, stats['flood_waits']) for peer, stats in OUTBOUND.stats().items()]),
+        ("bot_seen_link_lookups_total", "counter", "Duplicate link lookups",
+         [({'result': "hit"}, SEEN_LINKS.hits), ({'result': "miss"}, SEEN_LINKS.misses)]),
+        ("bot_correlation_entries", "gauge", "Message ids tracked along the bot chain",
+         [({'kind': kind}, count) for kind, count in CORRELATION_INDEX.stats().items()]),
+        ("bot_thumbnail_cache_bytes", "gauge", "Bytes held by the thumbnail cache",
+         [({'tier': "memory"}, thumbnails['memory_bytes']), ({'tier': "disk"}, thumbnails['disk_bytes'])]),
+        ("bot_trace_stage_seconds", "gauge", "Latency percentiles of each traced stage since start", stage_seconds),
+        ("bot_trace_spans_total", "counter", "Spans recorded per traced stage",
+         [({'stage': stage}, histogram.count) for stage, histogram in TRACER.histograms.items()]),
+    ] + COUNTERS.families())
+
+async def renew_queue_leases():
+    """Keep the leases of items this process is working on from running out, and drop state gone stale."""
+    while True:
+        await asyncio.sleep(QUEUE_LEASE_SECONDS / 3)
+        try:
+            MESSAGE_QUEUE.renew_leases()
+            LINK_QUEUE.renew_leases()
+            prune_queued_source_ids()
+            purged = SEEN_LINKS.purge_expired()
+            if purged:
+                logger.info(f"Purged {purged} expired seen link(s)")
+        except Exception as e:
+            logger.error(f"Error renewing queue leases: {e}")
+
+def start_workers():
+    """Start the message processor, LINK_WORKERS link workers and the housekeeping tasks."""
+    WORKER_TASKS['message_processor'] = asyncio.create_task(message_processor())
+    for worker_id in range(1, LINK_WORKERS + 1):
+        WORKER_TASKS[f'link_worker_{worker_id}'] = asyncio.create_task(process_queue(worker_id))
+    WORKER_TASKS['leases'] = asyncio.create_task(renew_queue_leases())
+    WORKER_TASKS['timers'] = asyncio.create_task(TIMERS.run())
+    logger.info(f"Started {LINK_WORKERS} link workers as {WORKER_ID}")
+
 async def main():
     """Main function to run the bot."""
+    monitoring = MonitoringServer("0.0.0.0", HTTP_PORT, health_checks, render_metrics) if HTTP_PORT else None
     try:
         print("Bot has started.")
+        if monitoring:
+            await monitoring.start()
         
-        # Start the message and link processors
-        message_processor_task = asyncio.create_task(message_processor())
-        queue_processor = asyncio.create_task(process_queue())
+        # Resume whatever a previous run left half done
+        resumed = MESSAGE_QUEUE.recover() + LINK_QUEUE.recover()
+        if resumed:
+            logger.info(f"Resumed {resumed} in-flight queue items from the previous run")
+        logger.info(f"Queue backlog: {MESSAGE_QUEUE.qsize()} messages, {LINK_QUEUE.qsize()} links")
         
-        # Start the client
+        # Start the client before the processors, a resumed backlog needs the connection
         await client.start()
+        await apply_config(config_manager.data)
+        
+        # Start the message and link processors
+        start_workers()
+        
+        # Catch up on what was posted while the bot was offline, live messages wait for it
+        if BACKFILL_ON_START:
+            catch_up_task = asyncio.create_task(catch_up_sources())
+        else:
+            LIVE_INGEST_OPEN.set()
         
         # Run until disconnected
         await client.run_until_disconnected()
@@ -522,7 +1444,11 @@ async def main():
     except Exception as e:
         logger.error(f"Error in main: {e}")
     finally:
+        if monitoring:
+            await monitoring.stop()
         await client.disconnect()
+        TRACER.close()
+        STATE_DB.close()
 
 if __name__ == "__main__":
     # Run the main function
@@ -0,0 +1,141 @@
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_username(username: str) -> str:
+    return username.strip().lstrip('@').lower()
+
+
+def percentile_of(values: Iterable[float], percentile: float) -> Optional[float]:
+    """Value at `percentile` (0-100) of `values`, None when there are none."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class DownloaderStats:
+    """Rolling health figures of one downloader bot."""
+
+    def __init__(self, username: str, window: int = 50):
+        self.username = username
+        self.outstanding = 0
+        self.completed = 0
+        self.failed = 0
+        self.consecutive_timeouts = 0
+        self.quarantined_until = 0.0
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.finished_at: Deque[float] = deque(maxlen=window)
+
+    @property
+    def success_rate(self) -> float:
+        # Unknown bots start out optimistic so they get tried
+        if not self.outcomes:
+            return 1.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Latency at `percentile` (0-100) over the window, None without samples."""
+        return percentile_of(self.latencies, percentile)
+
+    def throughput(self, now: float) -> float:
+        """Links finished per minute over the window."""
+        if len(self.finished_at) < 2:
+            return float(len(self.finished_at))
+        span = max(now - self.finished_at[0], 1.0)
+        return len(self.finished_at) / span * 60
+
+    def quarantined(self, now: float) -> bool:
+        return now < self.quarantined_until
+
+
+class DownloaderPool:
+    """Spreads links over several downloader bots by load and health.
+
+    A bot's score is its expected wait, (outstanding + 1) * median latency,
+    divided by its recent success rate; the lowest score gets the next link.
+    After `quarantine_after` timeouts in a row a bot is skipped for
+    `quarantine_seconds`, unless every bot is quarantined.
+    """
+
+    def __init__(self, usernames: Iterable[str], quarantine_after: int = 3,
+                 quarantine_seconds: float = 600, default_latency: float = 30):
+        self.quarantine_after = quarantine_after
+        self.quarantine_seconds = quarantine_seconds
+        self.default_latency = default_latency
+        self.bots: Dict[str, DownloaderStats] = {}
+        self.set_bots(usernames)
+
+    @property
+    def usernames(self) -> List[str]:
+        return list(self.bots)
+
+    def set_bots(self, usernames: Iterable[str]):
+        """Replace the pool, keeping the figures of bots that stay in it."""
+        names = [normalize_username(name) for name in usernames if name.strip()]
+        if not names:
+            raise ValueError("the downloader pool needs at least one bot")
+        self.bots = {name: self.bots.get(name) or DownloaderStats(name) for name in names}
+
+    def __contains__(self, username: str) -> bool:
+        return normalize_username(username) in self.bots
+
+    def pick(self) -> str:
+        now = time.monotonic()
+        healthy = [bot for bot in self.bots.values() if not bot.quarantined(now)]
+        if not healthy:
+            # Everyone is quarantined: use whoever comes out first
+            return min(self.bots.values(), key=lambda bot: bot.quarantined_until).username
+        return min(healthy, key=self._score).username
+
+    def _score(self, bot: DownloaderStats) -> float:
+        latency = bot.latency_percentile(50) or self.default_latency
+        return (bot.outstanding + 1) * latency / max(bot.success_rate, 0.05)
+
+    def started(self, username: str):
+        self.bots[username].outstanding += 1
+
+    def finished(self, username: str, latency: Optional[float], timed_out: bool = False):
+        """Record the outcome of a link; `latency` is None when no file arrived."""
+        bot = self.bots.get(username)
+        if bot is None:
+            return
+        now = time.monotonic()
+        bot.outstanding = max(0, bot.outstanding - 1)
+        bot.finished_at.append(now)
+        if latency is not None:
+            bot.completed += 1
+            bot.outcomes.append(True)
+            bot.latencies.append(latency)
+            bot.consecutive_timeouts = 0
+            return
+        bot.failed += 1
+        bot.outcomes.append(False)
+        if timed_out:
+            bot.consecutive_timeouts += 1
+            if bot.consecutive_timeouts >= self.quarantine_after:
+                bot.quarantined_until = now + self.quarantine_seconds
+                bot.consecutive_timeouts = 0
+                logger.warning(f"Quarantined downloader bot @{username} for {self.quarantine_seconds:.0f}s")
+
+    def stats(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        return {
+            bot.username: {
+                'outstanding': bot.outstanding,
+                'completed': bot.completed,
+                'failed': bot.failed,
+                'success_rate': round(bot.success_rate, 3),
+                'latency_p50': bot.latency_percentile(50),
+                'latency_p90': bot.latency_percentile(90),
+                'links_per_minute': round(bot.throughput(now), 2),
+                'quarantined': bot.quarantined(now),
+            }
+            for bot in self.bots.values()
+        }
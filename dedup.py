@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import math
+import time
+from typing import Iterable, List, Optional
+
+from storage import StateDB
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed size Bloom filter; answers "definitely new" without touching SQLite."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class SeenLinkIndex:
+    """Persistent set of canonical links already handled, with a TTL.
+
+    A Bloom filter in front of the `seen_links` table keeps lookups for new
+    links in memory; only probable hits are confirmed against the table. The
+    file store links posted for an entry are kept so a duplicate can be
+    reposted without another downloader round trip, and so are the
+    destinations the link was routed to, which lets another source route it
+    to further destinations later. Keys written by other processes sharing
+    the database reach the filter within `sync_interval`.
+    """
+
+    def __init__(self, db: StateDB, ttl: float, capacity: int = 1_000_000, error_rate: float = 0.001,
+                 sync_interval: float = 1.0):
+        self.db = db
+        self.ttl = ttl
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.sync_interval = sync_interval
+        self.hits = 0
+        self.misses = 0
+        self._synced_rowid = 0
+        self._synced_at = 0.0
+        db.conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen_links ("
+            " key TEXT PRIMARY KEY,"
+            " seen_at REAL NOT NULL,"
+            " posts TEXT,"
+            " destinations TEXT)"
+        )
+        columns = {row[1] for row in db.conn.execute("PRAGMA table_info(seen_links)")}
+        if "destinations" not in columns:
+            db.conn.execute("ALTER TABLE seen_links ADD COLUMN destinations TEXT")
+        # purge_expired runs periodically, not only at startup
+        db.conn.execute("CREATE INDEX IF NOT EXISTS seen_links_seen_at ON seen_links (seen_at)")
+        self.purge_expired()
+        self.sync()
+
+    def sync(self):
+        """Add keys recorded since the last sync, including other processes' ones."""
+        for rowid, key in self.db.query(
+            "SELECT rowid, key FROM seen_links WHERE rowid > ? ORDER BY rowid", (self._synced_rowid,)
+        ):
+            self.bloom.add(key)
+            self._synced_rowid = rowid
+        self._synced_at = time.monotonic()
+
+    def seen(self, key: str) -> bool:
+        """True if `key` was handled within the TTL."""
+        if time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+        found = key in self.bloom and self._row(key) is not None
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+    def add(self, key: str, destinations: Iterable[int] = ()):
+        self.bloom.add(key)
+        self.db.execute(
+            "INSERT INTO seen_links (key, seen_at, destinations) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET seen_at = excluded.seen_at, destinations = excluded.destinations",
+            (key, time.time(), json.dumps(list(destinations))),
+        )
+
+    def destinations(self, key: str) -> List[int]:
+        """Destinations `key` was routed to so far."""
+        row = self._row(key)
+        return json.loads(row[2]) if row and row[2] else []
+
+    def add_destinations(self, key: str, destinations: Iterable[int]) -> List[int]:
+        """Route `key` to `destinations` as well; returns the ones that are new."""
+        known = self.destinations(key)
+        added = [chat_id for chat_id in destinations if chat_id not in known]
+        if added:
+            self.db.execute(
+                "UPDATE seen_links SET destinations = ? WHERE key = ?", (json.dumps(known + added), key)
+            )
+        return added
+
+    def forget(self, key: str):
+        """Allow `key` again, e.g. after its job failed."""
+        self.db.execute("DELETE FROM seen_links WHERE key = ?", (key,))
+
+    def record_post(self, key: str, text: str):
+        """Remember a file store link posted for `key`."""
+        posts = self.posts(key)
+        posts.append(text)
+        self.db.execute("UPDATE seen_links SET posts = ? WHERE key = ?", (json.dumps(posts), key))
+
+    def posts(self, key: str) -> List[str]:
+        row = self._row(key)
+        return json.loads(row[1]) if row and row[1] else []
+
+    def purge_expired(self) -> int:
+        """Delete entries older than the TTL; returns how many."""
+        cursor = self.db.execute("DELETE FROM seen_links WHERE seen_at < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def _row(self, key: str) -> Optional[tuple]:
+        row = self.db.query("SELECT seen_at, posts, destinations FROM seen_links WHERE key = ?", (key,)).fetchone()
+        if row and row[0] < time.time() - self.ttl:
+            return None
+        return row
@@ -0,0 +1,468 @@
+import asyncio
+import itertools
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import StateDB
+
+
+def encode_payload(payload: Any) -> str:
+    """JSON text of a payload; records that have `to_dict` are stored as that dict."""
+    return json.dumps(payload.to_dict() if hasattr(payload, "to_dict") else payload)
+
+
+class MemoryJobQueue:
+    """In-process queue with the same ack/nack interface as SqliteJobQueue.
+
+    `get` hands out `(item_id, payload)`; the item stays in flight until it is
+    acknowledged with `ack` or put back with `nack`.
+
+    With `maxsize`, `put` waits while that many items are ready. Given an
+    `overflow` queue it spills them there instead of waiting and takes them
+    back, oldest first, as room frees up.
+    """
+
+    def __init__(self, name: str = "jobs", maxsize: int = 0, overflow: Optional["SqliteJobQueue"] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._ready: "OrderedDict[int, Any]" = OrderedDict()
+        self._in_flight: Dict[int, Any] = {}
+        self._keys: Dict[str, int] = {}
+        self._key_of: Dict[int, str] = {}
+        self._spilled_keys: Dict[int, str] = {}  # Overflow row id -> dedup key
+        self._spilled = 0
+        self._ids = itertools.count(1)
+        self._delayed = 0
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+
+    def _full(self) -> bool:
+        return bool(self.maxsize) and len(self._ready) >= self.maxsize
+
+    async def put(self, payload: Any, dedup_key: Optional[str] = None) -> Optional[int]:
+        """Queue `payload`; returns None if an item with `dedup_key` is still pending."""
+        while True:
+            if dedup_key is not None and dedup_key in self._keys:
+                return None
+            if self.overflow is not None and (self._spilled or self._full()):
+                return await self._spill(payload, dedup_key)
+            if not self._full():
+                break
+            self._not_full.clear()
+            await self._not_full.wait()
+        item_id = next(self._ids)
+        self._track_key(item_id, dedup_key)
+        self._ready[item_id] = payload
+        self._not_empty.set()
+        return item_id
+
+    def _track_key(self, item_id: int, dedup_key: Optional[str]):
+        if dedup_key is not None:
+            self._keys[dedup_key] = item_id
+            self._key_of[item_id] = dedup_key
+
+    async def _spill(self, payload: Any, dedup_key: Optional[str]) -> Optional[int]:
+        row_id = await self.overflow.put(payload)
+        self._spilled += 1
+        if dedup_key is not None:
+            # Negative ids mark keys of spilled items
+            self._keys[dedup_key] = -row_id
+            self._spilled_keys[row_id] = dedup_key
+        self._not_empty.set()
+        return -row_id
+
+    def _refill(self):
+        """Move spilled items back while there is room."""
+        while self._spilled and not self._full():
+            item = self.overflow.get_nowait()
+            if item is None:
+                self._spilled = 0
+                return
+            row_id, payload = item
+            self.overflow.ack(row_id)
+            self._spilled -= 1
+            item_id = next(self._ids)
+            key = self._spilled_keys.pop(row_id, None)
+            if key is not None:
+                del self._keys[key]
+            self._track_key(item_id, key)
+            self._ready[item_id] = payload
+
+    async def get(self) -> Tuple[int, Any]:
+        while not self._ready:
+            self._refill()
+            if self._ready:
+                break
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        item_id, payload = self._ready.popitem(last=False)
+        self._in_flight[item_id] = payload
+        self._refill()
+        self._not_full.set()
+        return item_id, payload
+
+    def ack(self, item_id: int):
+        self._in_flight.pop(item_id, None)
+        key = self._key_of.pop(item_id, None)
+        if key is not None:
+            del self._keys[key]
+
+    def nack(self, item_id: int, delay: float = 0, payload: Optional[Any] = None):
+        """Put an item back, at the front or after `delay` seconds, optionally with a new payload."""
+        current = self._in_flight.pop(item_id, None)
+        if current is None:
+            return
+        payload = current if payload is None else payload
+        if delay > 0:
+            self._delayed += 1
+            asyncio.get_event_loop().call_later(delay, self._release, item_id, payload)
+            return
+        self._ready[item_id] = payload
+        self._ready.move_to_end(item_id, last=False)
+        self._not_empty.set()
+
+    def _release(self, item_id: int, payload: Any):
+        self._delayed -= 1
+        self._ready[item_id] = payload
+        self._not_empty.set()
+
+    def qsize(self) -> int:
+        return len(self._ready) + self._spilled
+
+    def spilled(self) -> int:
+        return self._spilled
+
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def delayed(self) -> int:
+        return self._delayed
+
+    def recover(self) -> int:
+        """Nothing survives a restart in memory, except items spilled to the overflow queue."""
+        if self.overflow is None:
+            return 0
+        self.overflow.recover()
+        self._spilled = self.overflow.qsize()
+        self._refill()
+        if self._ready:
+            self._not_empty.set()
+        return len(self._ready) + self._spilled
+
+    def renew_leases(self) -> int:
+        return 0
+
+
+class SqliteJobQueue:
+    """Durable FIFO queue stored in a StateDB table, delivered at least once.
+
+    Several bot processes (one per Telegram account) can share the database
+    file. A worker claims an item with a lease that `renew_leases` keeps
+    extending while the worker lives; the item is deleted on `ack`. Items
+    whose lease ran out, because their worker died, are claimed again by
+    whoever asks next, so every item is handled by exactly one live worker.
+    `dedup_key` keeps the same source message queued by several processes
+    from becoming several items. Items are handed out in the order they
+    became available; one put back with a delay is not handed out before
+    its `available_at`.
+
+    With `maxsize`, `put` waits while that many items are ready. It checks a
+    count kept up to date by this process and read again from the database
+    every `poll_interval`, so puts of other processes can overshoot the bound
+    for that long. Payloads are stored as JSON; with `record_type` they come
+    back as `record_type.from_dict(...)`.
+    """
+
+    READY = 0
+    IN_FLIGHT = 1
+
+    def __init__(self, db: StateDB, name: str, worker_id: str = "worker", lease_seconds: float = 300,
+                 poll_interval: float = 1.0, maxsize: int = 0, record_type: Optional[type] = None):
+        self.db = db
+        self.name = name
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.maxsize = maxsize
+        self.record_type = record_type
+        self._size: Optional[int] = None
+        self._size_at = 0.0
+        db.conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue_items ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " queue TEXT NOT NULL,"
+            " status INTEGER NOT NULL DEFAULT 0,"
+            " payload TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " dedup_key TEXT,"
+            " owner TEXT,"
+            " claim TEXT,"
+            " lease_until REAL,"
+            " available_at REAL NOT NULL DEFAULT 0)"
+        )
+        # Databases written before leases existed lack the newer columns
+        columns = {row[1] for row in db.conn.execute("PRAGMA table_info(queue_items)")}
+        for column, kind in (("dedup_key", "TEXT"), ("owner", "TEXT"), ("claim", "TEXT"), ("lease_until", "REAL"),
+                             ("available_at", "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:
+                db.conn.execute(f"ALTER TABLE queue_items ADD COLUMN {column} {kind}")
+        # Claims look up the next available item and expired leases separately, each on its own index
+        db.conn.execute("DROP INDEX IF EXISTS queue_items_ready")
+        db.conn.execute(
+            "CREATE INDEX IF NOT EXISTS queue_items_available ON queue_items (queue, status, available_at, id)"
+        )
+        db.conn.execute(
+            "CREATE INDEX IF NOT EXISTS queue_items_lease ON queue_items (queue, status, lease_until)"
+        )
+        db.conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS queue_items_dedup ON queue_items (queue, dedup_key)"
+        )
+        db.conn.execute("CREATE INDEX IF NOT EXISTS queue_items_claim ON queue_items (claim)")
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+
+    async def put(self, payload: Any, dedup_key: Optional[str] = None) -> Optional[int]:
+        """Queue `payload`; returns None if an item with `dedup_key` is still pending."""
+        refresh = False
+        while self.maxsize and self._full(refresh):
+            if dedup_key is not None and self._pending(dedup_key):
+                return None
+            # Workers of other processes do not wake us up, so poll as well
+            self._not_full.clear()
+            try:
+                await asyncio.wait_for(self._not_full.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            refresh = True
+        now = time.time()
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO queue_items (queue, status, payload, created_at, dedup_key, available_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (self.name, self.READY, encode_payload(payload), now, dedup_key, now),
+        )
+        if not cursor.rowcount:
+            return None
+        if self._size is not None:
+            self._size += 1
+        self._not_empty.set()
+        return cursor.lastrowid
+
+    def _full(self, refresh: bool = False) -> bool:
+        """Whether `maxsize` items are ready, without counting them on every put."""
+        now = time.monotonic()
+        if refresh or self._size is None or now - self._size_at >= self.poll_interval:
+            self._size = self.qsize()
+            self._size_at = now
+        return self._size >= self.maxsize
+
+    def _pending(self, dedup_key: str) -> bool:
+        return self.db.query(
+            "SELECT 1 FROM queue_items WHERE queue = ? AND dedup_key = ?", (self.name, dedup_key)
+        ).fetchone() is not None
+
+    def _decode(self, payload: str) -> Any:
+        data = json.loads(payload)
+        return self.record_type.from_dict(data) if self.record_type else data
+
+    async def get(self) -> Tuple[int, Any]:
+        while True:
+            item = self.get_nowait()
+            if item:
+                return item
+            # Other processes and expired leases do not wake us up, so poll as well
+            self._not_empty.clear()
+            try:
+                await asyncio.wait_for(self._not_empty.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_nowait(self) -> Optional[Tuple[int, Any]]:
+        """Claim the next item, or None when nothing is ready."""
+        row = self._claim()
+        if not row:
+            return None
+        if self._size:
+            self._size -= 1
+        self._not_full.set()
+        return row[0], self._decode(row[1])
+
+    def _claim(self) -> Optional[tuple]:
+        """Atomically lease an abandoned item, or else the next available one, to this worker."""
+        now = time.time()
+        # Unique across queues and processes, even ones started with the same worker id
+        claim = uuid.uuid4().hex
+        lease = (self.IN_FLIGHT, self.worker_id, claim, now + self.lease_seconds)
+        # One OR of both conditions cannot use an index and sorts the whole queue on every claim
+        cursor = self.db.execute(
+            "UPDATE queue_items SET status = ?, owner = ?, claim = ?, lease_until = ?"
+            " WHERE id = (SELECT id FROM queue_items WHERE queue = ? AND status = ? AND lease_until < ?"
+            "  ORDER BY lease_until LIMIT 1)",
+            lease + (self.name, self.IN_FLIGHT, now),
+        )
+        if not cursor.rowcount:
+            cursor = self.db.execute(
+                "UPDATE queue_items SET status = ?, owner = ?, claim = ?, lease_until = ?"
+                " WHERE id = (SELECT id FROM queue_items WHERE queue = ? AND status = ? AND available_at <= ?"
+                "  ORDER BY available_at, id LIMIT 1)",
+                lease + (self.name, self.READY, now),
+            )
+        if not cursor.rowcount:
+            return None
+        return self.db.query(
+            "SELECT id, payload FROM queue_items WHERE queue = ? AND claim = ?", (self.name, claim)
+        ).fetchone()
+
+    def ack(self, item_id: int):
+        self.db.execute(
+            "DELETE FROM queue_items WHERE id = ? AND status = ? AND owner = ?",
+            (item_id, self.IN_FLIGHT, self.worker_id),
+        )
+
+    def nack(self, item_id: int, delay: float = 0, payload: Optional[Any] = None):
+        """Put an item back, available again after `delay` seconds, optionally with a new payload."""
+        if payload is None:
+            cursor = self.db.execute(
+                "UPDATE queue_items SET status = ?, owner = NULL, claim = NULL, lease_until = NULL,"
+                " available_at = ? WHERE id = ? AND status = ? AND owner = ?",
+                (self.READY, time.time() + delay, item_id, self.IN_FLIGHT, self.worker_id),
+            )
+        else:
+            cursor = self.db.execute(
+                "UPDATE queue_items SET status = ?, owner = NULL, claim = NULL, lease_until = NULL,"
+                " available_at = ?, payload = ? WHERE id = ? AND status = ? AND owner = ?",
+                (self.READY, time.time() + delay, encode_payload(payload), item_id, self.IN_FLIGHT, self.worker_id),
+            )
+        if cursor.rowcount and not delay:
+            self._not_empty.set()
+
+    def renew_leases(self) -> int:
+        """Extend the leases of every item this worker holds."""
+        cursor = self.db.execute(
+            "UPDATE queue_items SET lease_until = ? WHERE queue = ? AND status = ? AND owner = ?",
+            (time.time() + self.lease_seconds, self.name, self.IN_FLIGHT, self.worker_id),
+        )
+        return cursor.rowcount
+
+    def qsize(self) -> int:
+        """Items a worker could take right now; delayed retries are not counted."""
+        return self.db.query(
+            "SELECT COUNT(*) FROM queue_items WHERE queue = ? AND status = ? AND available_at <= ?",
+            (self.name, self.READY, time.time()),
+        ).fetchone()[0]
+
+    def in_flight(self) -> int:
+        return self._count(self.IN_FLIGHT)
+
+    def delayed(self) -> int:
+        """Ready items that are waiting for their retry delay."""
+        return self.db.query(
+            "SELECT COUNT(*) FROM queue_items WHERE queue = ? AND status = ? AND available_at > ?",
+            (self.name, self.READY, time.time()),
+        ).fetchone()[0]
+
+    def recover(self) -> int:
+        """Release items a previous run of this worker left in flight."""
+        cursor = self.db.execute(
+            "UPDATE queue_items SET status = ?, owner = NULL, claim = NULL, lease_until = NULL"
+            " WHERE queue = ? AND status = ? AND owner = ?",
+            (self.READY, self.name, self.IN_FLIGHT, self.worker_id),
+        )
+        self.db.commit()
+        if cursor.rowcount:
+            self._not_empty.set()
+        return cursor.rowcount
+
+    def _count(self, status: int) -> int:
+        return self.db.query(
+            "SELECT COUNT(*) FROM queue_items WHERE queue = ? AND status = ?", (self.name, status)
+        ).fetchone()[0]
+
+
+class DeadLetterStore:
+    """Persistent parking place for items that failed too often.
+
+    Entries keep the payload, the last error and the number of attempts, so
+    they can be inspected and replayed onto their queue later.
+    """
+
+    def __init__(self, db: StateDB):
+        self.db = db
+        db.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letters ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " queue TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " error TEXT,"
+            " attempts INTEGER NOT NULL,"
+            " failed_at REAL NOT NULL)"
+        )
+
+    def add(self, queue: str, payload: Any, error: Optional[str], attempts: int) -> int:
+        cursor = self.db.execute(
+            "INSERT INTO dead_letters (queue, payload, error, attempts, failed_at) VALUES (?, ?, ?, ?, ?)",
+            (queue, encode_payload(payload), error, attempts, time.time()),
+        )
+        return cursor.lastrowid
+
+    def entries(self, limit: int = 20) -> List[dict]:
+        """Newest entries first."""
+        rows = self.db.query(
+            "SELECT id, queue, payload, error, attempts, failed_at FROM dead_letters ORDER BY id DESC LIMIT ?",
+            (limit,),
+        )
+        return [self._entry(row) for row in rows]
+
+    def take(self, entry_id: Optional[int] = None) -> List[dict]:
+        """Remove and return one entry, or all of them when `entry_id` is None."""
+        if entry_id is None:
+            rows = self.db.query(
+                "SELECT id, queue, payload, error, attempts, failed_at FROM dead_letters ORDER BY id"
+            ).fetchall()
+            self.db.execute("DELETE FROM dead_letters WHERE id <= ?", (rows[-1][0] if rows else 0,))
+        else:
+            rows = self.db.query(
+                "SELECT id, queue, payload, error, attempts, failed_at FROM dead_letters WHERE id = ?",
+                (entry_id,),
+            ).fetchall()
+            self.db.execute("DELETE FROM dead_letters WHERE id = ?", (entry_id,))
+        return [self._entry(row) for row in rows]
+
+    def __len__(self):
+        return self.db.query("SELECT COUNT(*) FROM dead_letters").fetchone()[0]
+
+    @staticmethod
+    def _entry(row: tuple) -> dict:
+        entry_id, queue, payload, error, attempts, failed_at = row
+        return {
+            'id': entry_id,
+            'queue': queue,
+            'payload': json.loads(payload),
+            'error': error,
+            'attempts': attempts,
+            'failed_at': failed_at,
+        }
+
+
+def open_queue(backend: str, name: str, db: Optional[StateDB] = None, maxsize: int = 0, spill: bool = False,
+               record_type: Optional[type] = None, **options):
+    """Queue for `backend` ("memory" or "sqlite"); `options` go to SqliteJobQueue.
+
+    `spill` gives a bounded memory queue an overflow queue in `db`; SQLite
+    queues live on disk already and only use `maxsize`.
+    """
+    if backend == "memory":
+        overflow = None
+        if spill and maxsize:
+            if db is None:
+                raise ValueError("spilling a memory queue needs a StateDB")
+            overflow = SqliteJobQueue(db, f"{name}.overflow", record_type=record_type)
+        return MemoryJobQueue(name, maxsize, overflow)
+    if backend == "sqlite":
+        if db is None:
+            raise ValueError("the sqlite queue backend needs a StateDB")
+        return SqliteJobQueue(db, name, maxsize=maxsize, record_type=record_type, **options)
+    raise ValueError(f"Unknown queue backend: {backend}")
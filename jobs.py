@@ -0,0 +1,353 @@
+import asyncio
+import itertools
+import logging
+from collections import defaultdict, deque
+from enum import Enum
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from timer_wheel import TimerWheel
+from tracing import new_trace_id
+
+logger = logging.getLogger(__name__)
+
+
+class JobState(Enum):
+    """Stages a Terabox link goes through on its way to the destination channel."""
+    QUEUED = "queued"
+    SENT_TO_DOWNLOADER = "sent_to_downloader"
+    FILE_RECEIVED = "file_received"
+    FORWARDED_TO_STORE = "forwarded_to_store"
+    LINK_RECEIVED = "link_received"
+    POSTED = "posted"
+    FAILED = "failed"
+
+
+class StageTimeout(asyncio.TimeoutError):
+    """A job made no progress in `stage` within the time allowed for it."""
+
+    def __init__(self, stage: JobState, seconds: float):
+        super().__init__(f"no progress in {stage.value} for {seconds:.0f}s")
+        self.stage = stage
+        self.seconds = seconds
+
+
+class LinkRecord:
+    """What LINK_QUEUE holds for one link until a worker takes it.
+
+    Only ids and short strings: the source message is referred to by chat
+    and message id and its cover image by its ThumbnailStore key, so a queued
+    link never keeps a Telethon object or image bytes alive.
+    """
+
+    __slots__ = ("link", "key", "text", "thumbnail", "destinations", "chat_id", "message_id",
+                 "trace_id", "queued_at", "attempts")
+
+    def __init__(self, link: str, key: Optional[str] = None, text: str = "", thumbnail: Optional[str] = None,
+                 destinations: Iterable[int] = (), chat_id: Optional[int] = None, message_id: Optional[int] = None,
+                 trace_id: Optional[str] = None, queued_at: Optional[float] = None, attempts: int = 0):
+        self.link = link
+        self.key = key or link
+        self.text = text
+        self.thumbnail = thumbnail
+        self.destinations = tuple(destinations or ())
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.trace_id = trace_id
+        self.queued_at = queued_at
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"<LinkRecord {self.trace_id} {self.link}>"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LinkRecord":
+        """Record from its `to_dict` form, or from a payload queued before records existed."""
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    def to_dict(self) -> dict:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['destinations'] = list(self.destinations)
+        return data
+
+
+class LinkJob:
+    """Tracks a single link from the queue until every file it produced is posted.
+
+    A link can make the downloader bot send several files, so the job counts
+    every file received from it until its file store link is posted or the
+    file is dropped. It is done once at least one post went out, nothing is
+    outstanding and no new file arrived for `settle` seconds.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, link: str, text: str, thumbnail: Optional[str] = None, key: Optional[str] = None,
+                 destinations: Optional[List[int]] = None, trace_id: Optional[str] = None,
+                 post_group: Optional[Tuple[int, int]] = None):
+        self.id = next(self._ids)
+        self.trace_id = trace_id or new_trace_id()
+        self.link = link
+        self.key = key or link
+        self.text = text
+        self.thumbnail = thumbnail
+        self.destinations = list(destinations or [])
+        self.post_group = post_group  # Chat and message id of the source post this link came from
+        self.state = JobState.QUEUED
+        self.error: Optional[str] = None
+        self.failure: Optional[Exception] = None  # Raised by wait_done instead of a plain RuntimeError
+        self.downloader: Optional[str] = None
+        self.sent_at: Optional[float] = None
+        self.first_file_at: Optional[float] = None
+        self.files_received = 0
+        self.files_forwarded = 0
+        self.files_dropped = 0
+        self.files_posted = 0
+        self.store_latency: Optional[float] = None
+        self._forwarded_at: Deque[float] = deque()
+        self.created_at = asyncio.get_event_loop().time()
+        self.updated_at = self.created_at
+        self._idle = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    def __repr__(self):
+        return f"<LinkJob #{self.id} {self.trace_id} {self.state.value} {self.link}>"
+
+    @property
+    def share_id(self) -> str:
+        """The Terabox share id of the link, as it may show up in file names."""
+        return self.key.split(":", 1)[-1]
+
+    @property
+    def pending_files(self) -> int:
+        """Files received that are neither posted nor dropped yet.
+
+        This covers files still waiting to be forwarded, so a job is never
+        done while part of a batch is on its way to the file store bot.
+        """
+        return self.files_received - self.files_dropped - self.files_posted
+
+    def advance(self, state: JobState):
+        """Move the job to `state` and refresh its activity timestamp."""
+        self.state = state
+        self.updated_at = asyncio.get_event_loop().time()
+        self._changed.set()
+        logger.info(f"Job #{self.id} [{self.trace_id}] -> {state.value} ({self.link})")
+
+    def sent_to_downloader(self, downloader: Optional[str] = None):
+        self.downloader = downloader
+        self.advance(JobState.SENT_TO_DOWNLOADER)
+        self.sent_at = self.updated_at
+
+    def file_received(self):
+        self.files_received += 1
+        self._idle.clear()
+        self.advance(JobState.FILE_RECEIVED)
+        if self.first_file_at is None:
+            self.first_file_at = self.updated_at
+
+    @property
+    def downloader_latency(self) -> Optional[float]:
+        """Seconds the downloader bot took to send the first file."""
+        if self.sent_at is None or self.first_file_at is None:
+            return None
+        return self.first_file_at - self.sent_at
+
+    def file_forwarded(self):
+        self.files_forwarded += 1
+        self.advance(JobState.FORWARDED_TO_STORE)
+        self._forwarded_at.append(self.updated_at)
+
+    def file_dropped(self):
+        """A received file never made it to the file store bot."""
+        self.files_dropped += 1
+        self._update_idle()
+
+    def link_received(self):
+        self.advance(JobState.LINK_RECEIVED)
+        if self._forwarded_at:
+            # Seconds the file store bot took for the oldest file still waiting
+            self.store_latency = self.updated_at - self._forwarded_at.popleft()
+
+    def posted(self):
+        self.files_posted += 1
+        self.advance(JobState.POSTED)
+        self._update_idle()
+
+    def fail(self, reason: str, failure: Optional[Exception] = None):
+        self.error = reason
+        self.failure = failure
+        self.advance(JobState.FAILED)
+        self._idle.set()
+
+    @property
+    def done(self) -> bool:
+        return self.state is JobState.FAILED or (
+            self.files_posted > 0 and self.pending_files <= 0 and self._idle.is_set()
+        )
+
+    def _update_idle(self):
+        if self.files_posted > 0 and self.pending_files <= 0:
+            self._idle.set()
+            self._changed.set()
+
+    async def wait_done(self, settle: float = 5.0,
+                        stage_timeout: Optional[Callable[["LinkJob"], float]] = None):
+        """Wait until the job is posted and no further file arrived for `settle` seconds.
+
+        With `stage_timeout`, a job that stays in one state for longer than
+        `stage_timeout(job)` seconds while work is outstanding raises
+        StageTimeout.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            now = loop.time()
+            if self._idle.is_set():
+                if self.state is JobState.FAILED:
+                    raise self.failure or RuntimeError(self.error or "job failed")
+                wait = self.updated_at + settle - now
+                if wait <= 0:
+                    return
+            elif stage_timeout is not None:
+                allowed = stage_timeout(self)
+                wait = self.updated_at + allowed - now
+                if wait <= 0:
+                    raise StageTimeout(self.state, allowed)
+            else:
+                wait = None
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+class CorrelationIndex:
+    """Constant time mapping of Telegram message ids back to the job they belong to.
+
+    The chain is: id of the link sent to the downloader bot -> the downloader's
+    reply (via `reply_to_msg_id`) -> id of the file forwarded to the file store
+    bot -> the file store bot's reply. Bots that do not reply to a message are
+    matched first-in first-out among the tracked entries, unless the file
+    name or text of their message names one of them. A reply to a message
+    that is not tracked (any more) is never matched.
+
+    With a `wheel`, an entry that sees no match for `ttl` seconds expires and
+    `on_expire(job, kind)` is called, `kind` being "sent" or "forwarded". A
+    sent message stays tracked for further files once the downloader bot
+    answered it, until `discard_job`.
+    """
+
+    def __init__(self, wheel: Optional[TimerWheel] = None, ttl: float = 300,
+                 on_expire: Optional[Callable[[LinkJob, str], None]] = None):
+        self.wheel = wheel
+        self.ttl = ttl
+        self.on_expire = on_expire
+        # Dicts keep insertion order, which is the FIFO order of the fallback
+        self._sent: Dict[int, Tuple[LinkJob, float]] = {}
+        self._forwarded: Dict[int, Tuple[LinkJob, float, Optional[str]]] = {}
+        self._by_job: Dict[int, List[int]] = defaultdict(list)
+        self._last_fallback: Dict[Optional[str], LinkJob] = {}
+
+    def __len__(self):
+        return len(self._sent) + len(self._forwarded)
+
+    def stats(self) -> Dict[str, int]:
+        return {'sent': len(self._sent), 'forwarded': len(self._forwarded), 'jobs': len(self._by_job)}
+
+    def track_sent(self, msg_id: int, job: LinkJob):
+        """Remember the message carrying `job`'s link to the downloader bot."""
+        self._sent[msg_id] = (job, asyncio.get_event_loop().time())
+        self._by_job[job.id].append(msg_id)
+        self._arm("sent", msg_id)
+
+    def track_forwarded(self, msg_id: int, job: LinkJob, file_name: Optional[str] = None):
+        """Remember a file of `job` forwarded to the file store bot."""
+        stem = file_name.rsplit(".", 1)[0] if file_name else None
+        self._forwarded[msg_id] = (job, asyncio.get_event_loop().time(), stem)
+        self._by_job[job.id].append(msg_id)
+        self._arm("forwarded", msg_id)
+
+    def match_downloader_reply(self, reply_to_msg_id: Optional[int], downloader: Optional[str] = None,
+                               text: Optional[str] = None) -> Optional[LinkJob]:
+        """Job a message from the `downloader` bot belongs to; `text` is its file name and caption."""
+        if reply_to_msg_id is not None:
+            entry = self._sent.get(reply_to_msg_id)
+            if entry:
+                # More files may follow, the entry stays until the job is discarded
+                self._disarm("sent", reply_to_msg_id)
+                return entry[0]
+            # Most likely a late file of a job that timed out, it belongs to none of the others
+            logger.warning(f"Downloader reply to untracked message {reply_to_msg_id}, not matching it")
+            return None
+        candidates = [
+            (msg_id, job) for msg_id, (job, _) in self._sent.items()
+            if not (downloader and job.downloader != downloader)
+        ]
+        # A file name or caption carrying a share id settles it
+        if text:
+            for msg_id, job in candidates:
+                if job.share_id and job.share_id in text:
+                    self._last_fallback[job.downloader] = job
+                    self._disarm("sent", msg_id)
+                    return job
+        # Otherwise the oldest job of that bot still waiting for its first
+        # file, or else the job matched last gets the file
+        for msg_id, job in candidates:
+            if job.files_received == 0:
+                self._last_fallback[job.downloader] = job
+                self._disarm("sent", msg_id)
+                return job
+        last = self._last_fallback.get(downloader)
+        if last and last.id in self._by_job:
+            return last
+        return None
+
+    def match_file_store_reply(self, reply_to_msg_id: Optional[int], text: Optional[str] = None) -> Optional[LinkJob]:
+        """Job a file store link belongs to; each forwarded file is matched once."""
+        if reply_to_msg_id is not None:
+            entry = self._forwarded.pop(reply_to_msg_id, None)
+            if entry:
+                self._disarm("forwarded", reply_to_msg_id)
+                return entry[0]
+            logger.warning(f"File store reply to untracked message {reply_to_msg_id}, not matching it")
+            return None
+        # A link naming the forwarded file goes to that file, the oldest file otherwise
+        named = [(msg_id, entry) for msg_id, entry in self._forwarded.items() if text and entry[2] and entry[2] in text]
+        for msg_id, (job, _, _) in named or self._forwarded.items():
+            del self._forwarded[msg_id]
+            self._disarm("forwarded", msg_id)
+            return job
+        return None
+
+    def discard_job(self, job: LinkJob):
+        """Forget every message id tracked for `job`."""
+        for msg_id in self._by_job.pop(job.id, ()):
+            if self._sent.pop(msg_id, None):
+                self._disarm("sent", msg_id)
+            if self._forwarded.pop(msg_id, None):
+                self._disarm("forwarded", msg_id)
+        if self._last_fallback.get(job.downloader) is job:
+            del self._last_fallback[job.downloader]
+
+    def _arm(self, kind: str, msg_id: int):
+        if self.wheel is not None:
+            self.wheel.schedule((kind, msg_id), self.ttl, lambda: self._expire(kind, msg_id))
+
+    def _disarm(self, kind: str, msg_id: int):
+        if self.wheel is not None:
+            self.wheel.cancel((kind, msg_id))
+
+    def _expire(self, kind: str, msg_id: int):
+        entries = self._sent if kind == "sent" else self._forwarded
+        entry = entries.pop(msg_id, None)
+        if entry is None:
+            return
+        job = entry[0]
+        ids = self._by_job.get(job.id)
+        if ids and msg_id in ids:
+            ids.remove(msg_id)
+            if not ids:
+                del self._by_job[job.id]
+        logger.warning(f"Correlation entry {kind}:{msg_id} of job #{job.id} expired after {self.ttl:.0f}s")
+        if self.on_expire:
+            self.on_expire(job, kind)
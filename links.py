@@ -0,0 +1,107 @@
+import re
+from typing import Iterable, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from telethon.tl.types import Message, MessageEntityTextUrl, MessageEntityUrl
+
+# Hosts that serve the same Terabox share under different names
+TERABOX_HOSTS = (
+    "1024terabox.com",
+    "terabox.com",
+    "teraboxlink.com",
+    "terafileshare.com",
+    "teraboxshare.com",
+    "teraboxapp.com",
+    "terasharelink.com",
+)
+
+
+def link_host(url: str) -> str:
+    """Lower-cased host of `url` without a leading www."""
+    try:
+        host = (urlsplit(url.strip()).hostname or "").lower()
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def canonical_link(url: str, hosts: Iterable[str] = TERABOX_HOSTS) -> Optional[str]:
+    """Host independent key of a Terabox share link, None for anything else.
+
+    `https://1024terabox.com/s/1AbC?ref=x` and
+    `https://www.teraboxapp.com/sharing/link?surl=AbC` both become
+    `terabox:AbC`. Links in an unknown layout fall back to their path.
+    """
+    if link_host(url) not in hosts:
+        return None
+    parts = urlsplit(url.strip())
+
+    surl = parse_qs(parts.query).get("surl")
+    if surl and surl[0]:
+        return f"terabox:{surl[0]}"
+
+    segments = [segment for segment in parts.path.split("/") if segment]
+    if len(segments) >= 2 and segments[0] == "s":
+        share_id = segments[1]
+        # /s/1<surl> is the short form of ?surl=<surl>
+        return f"terabox:{share_id[1:] if share_id.startswith('1') else share_id}"
+    return f"terabox:{'/'.join(segments)}"
+
+
+def link_pattern(hosts: Iterable[str]) -> "re.Pattern":
+    """Compiled regex matching links on any of `hosts`."""
+    alternatives = "|".join(re.escape(host) for host in sorted(hosts, key=len, reverse=True))
+    return re.compile(rf"https?://(?:www\.)?(?:{alternatives})/\S+", re.IGNORECASE)
+
+
+class LinkExtractor:
+    """Finds Terabox links in a message, compiled once per host allow-list.
+
+    Telegram already marks links with `MessageEntityUrl` and
+    `MessageEntityTextUrl` entities, which also covers links hidden behind
+    text. The regex only runs for messages without any link entity.
+    """
+
+    def __init__(self, hosts: Iterable[str] = TERABOX_HOSTS):
+        self.set_hosts(hosts)
+
+    def set_hosts(self, hosts: Iterable[str]):
+        """Replace the allow-list; takes effect for the next message."""
+        hosts = frozenset(host.lower().strip() for host in hosts if host.strip())
+        if not hosts:
+            raise ValueError("the host allow-list cannot be empty")
+        self.pattern = link_pattern(hosts)
+        self.hosts = hosts
+
+    def is_allowed(self, url: str) -> bool:
+        return self.pattern.match(url) is not None
+
+    def extract_text(self, text: str) -> List[str]:
+        """Links found by the regex in plain `text`."""
+        return self.pattern.findall(text) if text else []
+
+    def extract(self, message: Message) -> List[str]:
+        """Links in `message`, in order and without repeats."""
+        entities = [
+            entity for entity in message.entities or ()
+            if isinstance(entity, (MessageEntityUrl, MessageEntityTextUrl))
+        ]
+        if not entities:
+            return list(dict.fromkeys(self.extract_text(message.raw_text)))
+
+        links = []
+        encoded = None
+        for entity in entities:
+            if isinstance(entity, MessageEntityTextUrl):
+                url = entity.url
+            else:
+                # Entity offsets count UTF-16 code units
+                if encoded is None:
+                    encoded = (message.message or "").encode("utf-16-le")
+                start = entity.offset * 2
+                url = encoded[start:start + entity.length * 2].decode("utf-16-le", "ignore")
+            if "://" not in url:
+                url = f"https://{url}"
+            if self.is_allowed(url):
+                links.append(url)
+        return list(dict.fromkeys(links))
@@ -0,0 +1,103 @@
+import json
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+# name, type, help text and (labels, value) samples of one metric
+MetricFamily = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+class Counters:
+    """Monotonic counters with optional labels, exported as Prometheus counters."""
+
+    def __init__(self):
+        self._values: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+        self._values[name]
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        series = self._values[name]
+        series[key] = series.get(key, 0) + value
+
+    def value(self, name: str, **labels: str) -> float:
+        return self._values.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def families(self) -> List[MetricFamily]:
+        return [
+            (name, "counter", self._help.get(name, name), [(dict(key), value) for key, value in series.items()])
+            for name, series in self._values.items()
+        ]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_metrics(families: Iterable[MetricFamily]) -> str:
+    """Render metric families in the Prometheus text exposition format."""
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MonitoringServer:
+    """Small aiohttp server on the bot's own event loop.
+
+    `/healthz` answers 200 or 503 from `health()`, which returns whether the
+    bot is healthy and the checks behind that verdict. `/metrics` serves
+    whatever `metrics()` renders.
+    """
+
+    def __init__(self, host: str, port: int, health: Callable[[], Tuple[bool, dict]],
+                 metrics: Callable[[], str]):
+        self.host = host
+        self.port = port
+        self.health = health
+        self.metrics = metrics
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self._handle_health)
+        app.router.add_get("/healthz", self._handle_health)
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Serving /healthz and /metrics on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        try:
+            healthy, checks = self.health()
+        except Exception as e:
+            logger.error(f"Error running health checks: {e}")
+            healthy, checks = False, {'error': str(e)}
+        return web.Response(
+            status=200 if healthy else 503,
+            text=json.dumps({'status': "ok" if healthy else "unhealthy", 'checks': checks}),
+            content_type="application/json",
+        )
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics(), content_type="text/plain", charset="utf-8")
@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+# Lower value wins when budgets are tight
+PRIORITY_POST = 0       # Posts to the destination channel
+PRIORITY_FORWARD = 1    # Files forwarded to the file store bot
+PRIORITY_SUBMIT = 2     # New links sent to the downloader bot
+PRIORITY_FETCH = 3      # Reading source messages again
+
+
+class TokenBucket:
+    """Token bucket whose rate backs off on FloodWait and recovers on success."""
+
+    def __init__(self, rate: float, burst: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.flood_waits = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def flood_wait(self, seconds: float, min_rate: float):
+        """Pause for `seconds` and halve the rate."""
+        self.flood_waits += 1
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.rate = max(min_rate, self.rate / 2)
+
+    def success(self):
+        """Creep back towards the configured rate."""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class OutboundScheduler:
+    """Central gate for outbound Telegram calls.
+
+    Every call takes a token from its peer's bucket and from the account
+    wide bucket. Waiting calls are released in priority order, so posts to
+    the destination go out before new submissions when budgets are tight.
+    A FloodWaitError pauses the peer for the given time, halves its rate
+    and retries the call instead of failing it; the rate creeps back up
+    with every call that goes through.
+    """
+
+    def __init__(self, peer_rate: float = 1.0, peer_burst: float = 3, global_rate: float = 20,
+                 max_flood_wait: float = 900, max_retries: int = 5):
+        self.peer_rate = peer_rate
+        self.peer_burst = peer_burst
+        self.max_flood_wait = max_flood_wait
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.buckets: Dict[str, TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def bucket(self, peer) -> TokenBucket:
+        key = str(peer)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.peer_rate, self.peer_burst)
+        return bucket
+
+    def set_rate(self, peer, rate: float, burst: Optional[float] = None):
+        bucket = self.bucket(peer)
+        bucket.max_rate = bucket.rate = rate
+        if burst is not None:
+            bucket.burst = burst
+
+    async def call(self, peer, func, *args, priority: int = PRIORITY_SUBMIT, **kwargs):
+        """Run `await func(*args, **kwargs)` once `peer`'s budget allows it."""
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(str(peer), priority)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                if e.seconds > self.max_flood_wait or attempt == self.max_retries:
+                    raise
+                logger.warning(f"FloodWait of {e.seconds}s for {peer}, delaying the call")
+                self.bucket(peer).flood_wait(e.seconds, self.peer_rate / 20)
+                continue
+            self.bucket(peer).success()
+            return result
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            peer: {'rate': round(bucket.rate, 3), 'flood_waits': bucket.flood_waits}
+            for peer, bucket in self.buckets.items()
+        }
+
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def _acquire(self, peer: str, priority: int):
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), peer, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        """Hand out tokens until nobody is waiting."""
+        while self._waiters:
+            self._wakeup.clear()
+            delay = self._release_next(time.monotonic())
+            if delay:
+                await self._sleep(delay)
+
+    def _release_next(self, now: float) -> Optional[float]:
+        """Release the best waiter whose budgets allow it to go now.
+
+        Returns 0 after releasing one, otherwise the seconds until the next
+        waiter could go, or None when nobody is waiting.
+        """
+        delay = self.global_bucket.wait_time(now)
+        if delay > 0:
+            return delay
+
+        delay = None
+        released = None
+        for entry in sorted(self._waiters):
+            _, _, peer, future = entry
+            if future.done():
+                # The caller was cancelled while waiting
+                self._waiters.remove(entry)
+                continue
+            peer_delay = self.bucket(peer).wait_time(now)
+            if peer_delay <= 0:
+                released = entry
+                break
+            delay = peer_delay if delay is None else min(delay, peer_delay)
+
+        if released:
+            self._waiters.remove(released)
+            self.bucket(released[2]).consume(now)
+            self.global_bucket.consume(now)
+            released[3].set_result(None)
+            delay = 0.0
+        heapq.heapify(self._waiters)
+        return delay
+
+    async def _sleep(self, delay: float):
+        """Sleep `delay` seconds or until a new call arrives."""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
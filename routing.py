@@ -0,0 +1,128 @@
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from links import link_host
+
+
+class Route:
+    """Sends links found in `sources` to `destinations`.
+
+    `hosts` limits the route to links on those hosts and `keywords` to
+    messages whose text contains one of them (case-insensitive); either one
+    left empty lets everything through.
+    """
+
+    def __init__(self, sources: Iterable[int], destinations: Iterable[int],
+                 hosts: Iterable[str] = (), keywords: Iterable[str] = (), name: Optional[str] = None):
+        self.sources = tuple(int(chat_id) for chat_id in sources)
+        self.destinations = tuple(int(chat_id) for chat_id in destinations)
+        if not self.sources or not self.destinations:
+            raise ValueError("a route needs at least one source and one destination")
+        self.hosts = frozenset(host.lower().strip() for host in hosts if host.strip())
+        keywords = [keyword for keyword in keywords if keyword]
+        self.keywords = tuple(keywords)
+        self.keyword_pattern = (
+            re.compile("|".join(re.escape(keyword) for keyword in keywords), re.IGNORECASE)
+            if keywords else None
+        )
+        self.name = name or f"{','.join(map(str, self.sources))}->{','.join(map(str, self.destinations))}"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Route":
+        return cls(
+            data.get("sources") or [], data.get("destinations") or [],
+            data.get("hosts") or (), data.get("keywords") or (), data.get("name"),
+        )
+
+    def to_dict(self) -> dict:
+        data = {'name': self.name, 'sources': list(self.sources), 'destinations': list(self.destinations)}
+        if self.hosts:
+            data['hosts'] = sorted(self.hosts)
+        if self.keywords:
+            data['keywords'] = list(self.keywords)
+        return data
+
+    def matches_text(self, text: str) -> bool:
+        return self.keyword_pattern is None or self.keyword_pattern.search(text or "") is not None
+
+    def matches_link(self, link: str) -> bool:
+        return not self.hosts or link_host(link) in self.hosts
+
+
+class Router:
+    """Routing table compiled into one lookup from source chat id to routes."""
+
+    def __init__(self, routes: Iterable[Route]):
+        self.routes = list(routes)
+        by_source: Dict[int, List[Route]] = {}
+        for route in self.routes:
+            for chat_id in route.sources:
+                by_source.setdefault(chat_id, []).append(route)
+        self._by_source: Dict[int, Tuple[Route, ...]] = {
+            chat_id: tuple(routes) for chat_id, routes in by_source.items()
+        }
+
+    @classmethod
+    def from_config(cls, data: dict) -> "Router":
+        """Router for the `routes` list of config.json, or its single source/destination pair."""
+        routes = data.get("routes")
+        if routes:
+            return cls(Route.from_dict(route) for route in routes)
+        return cls([Route([data["source_channel"]], [data["destination_channel"]], name="default")])
+
+    @property
+    def sources(self) -> List[int]:
+        return list(self._by_source)
+
+    @property
+    def destinations(self) -> Set[int]:
+        return {chat_id for route in self.routes for chat_id in route.destinations}
+
+    def routes_for(self, chat_id: int) -> Tuple[Route, ...]:
+        return self._by_source.get(chat_id, ())
+
+    def resolve(self, chat_id: int, text: str, links: Iterable[str]) -> Dict[str, List[int]]:
+        """Destinations of each link posted in `chat_id`; links no route takes are left out."""
+        routes = [route for route in self.routes_for(chat_id) if route.matches_text(text)]
+        resolved = {}
+        for link in links:
+            destinations = []
+            for route in routes:
+                if route.matches_link(link):
+                    destinations.extend(dest for dest in route.destinations if dest not in destinations)
+            if destinations:
+                resolved[link] = destinations
+        return resolved
+
+
+class PeerFilter:
+    """Peer ids an event handler accepts, replaced as a whole on reload.
+
+    Ids dropped by `replace` stay accepted for `drain` seconds, so replies
+    to jobs that were already in flight still reach their handler.
+    """
+
+    def __init__(self, ids: Iterable[int] = ()):
+        self.ids = frozenset(ids)
+        self._draining: Dict[int, float] = {}
+
+    def replace(self, ids: Iterable[int], drain: float = 0):
+        ids = frozenset(ids)
+        until = time.monotonic() + drain
+        for peer_id in self.ids - ids:
+            self._draining[peer_id] = until
+        for peer_id in ids:
+            self._draining.pop(peer_id, None)
+        self.ids = ids
+
+    def __contains__(self, peer_id: int) -> bool:
+        if peer_id in self.ids:
+            return True
+        until = self._draining.get(peer_id)
+        if until is None:
+            return False
+        if until > time.monotonic():
+            return True
+        del self._draining[peer_id]
+        return False
@@ -5,5 +5,4 @@ echo "Setting up environment...."
 echo "Dependencies installed during Docker build."
 
 echo "Starting Bot...."
-gunicorn app:app -w 4 -k sync --bind 0.0.0.0:8080 &
 python3 bot.py
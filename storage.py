@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import sqlite3
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StateDB:
+    """Shared SQLite connection (WAL mode) with batched commits.
+
+    Writes open a transaction that is committed once `batch_size` statements
+    piled up or `flush_interval` seconds passed, whichever comes first. Reads
+    on the same connection already see uncommitted writes. Everything that
+    persists bot state goes through one instance so writers never contend
+    for the database lock. Other bot processes may open the same file; a
+    batch takes the write lock when it starts and they wait up to `timeout`
+    seconds for it.
+    """
+
+    def __init__(self, path: str, batch_size: int = 64, flush_interval: float = 0.05, timeout: float = 30):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._pending = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        """Run a write statement inside the current batch."""
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+        cursor = self.conn.execute(sql, tuple(params))
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.commit()
+        elif self._flush_handle is None:
+            self._schedule_flush()
+        return cursor
+
+    def executemany(self, sql: str, rows: Iterable[Iterable[Any]]) -> sqlite3.Cursor:
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+        cursor = self.conn.executemany(sql, rows)
+        self.commit()
+        return cursor
+
+    def query(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        return self.conn.execute(sql, tuple(params))
+
+    def commit(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self.conn.in_transaction:
+            self.conn.execute("COMMIT")
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def get_value(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self.query("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_value(self, key: str, value: str):
+        self.execute(
+            "INSERT INTO kv (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    def set_max_value(self, key: str, value: int):
+        """Store `value` unless the stored number is already higher, in one statement."""
+        self.execute(
+            "INSERT INTO kv (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), CAST(excluded.value AS INTEGER))",
+            (key, str(value)),
+        )
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.commit()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        try:
+            self.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error committing state batch: {e}")
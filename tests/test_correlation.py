@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from jobs import CorrelationIndex, JobState, LinkJob, StageTimeout
+from timer_wheel import TimerWheel
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_untracked_reply_is_not_matched_by_order():
+    async def scenario():
+        index = CorrelationIndex()
+        a, b, c = (LinkJob(f"https://terabox.com/s/1job{name}", "", key=f"terabox:job{name}") for name in "abc")
+        for job in (a, b, c):
+            job.sent_to_downloader("dl")
+        index.track_sent(1, a)
+        index.track_sent(2, b)
+        index.track_sent(3, c)
+        index.track_forwarded(100, a)
+        index.track_forwarded(101, b)
+
+        # Job a timed out and was cleaned up before its late replies came in
+        index.discard_job(a)
+        assert index.match_file_store_reply(100) is None
+        assert index.match_downloader_reply(1, "dl") is None
+        assert index.match_downloader_reply(4, "dl") is None
+
+        # The other jobs still match their own replies
+        assert index.match_file_store_reply(101) is b
+        assert index.match_downloader_reply(3, "dl") is c
+
+    run(scenario())
+
+
+def test_fallback_prefers_the_job_named_in_the_file():
+    async def scenario():
+        index = CorrelationIndex()
+        a, b = (LinkJob(f"https://terabox.com/s/1job{name}", "", key=f"terabox:job{name}") for name in "ab")
+        for msg_id, job in enumerate((a, b), 1):
+            job.sent_to_downloader("dl")
+            index.track_sent(msg_id, job)
+
+        # The bot dropped job a, the first file it sends is b's
+        assert index.match_downloader_reply(None, "dl", "1jobb_0.mp4") is b
+        # Without a usable name the oldest job still waiting gets the file
+        assert index.match_downloader_reply(None, "dl", "video.mp4") is a
+
+        index.track_forwarded(200, a, "first.mp4")
+        index.track_forwarded(201, b, "second.mp4")
+        assert index.match_file_store_reply(None, "Link: https://t.me/store?start=second") is b
+        assert index.match_file_store_reply(None, "Link: https://t.me/store?start=other") is a
+
+    run(scenario())
+
+
+def test_expired_entries_leave_no_job_behind():
+    async def scenario():
+        expired = []
+        wheel = TimerWheel(tick=1.0)
+        index = CorrelationIndex(wheel=wheel, ttl=5, on_expire=lambda job, kind: expired.append((job, kind)))
+        job = LinkJob("https://terabox.com/s/1joba", "", key="terabox:joba")
+        index.track_sent(1, job)
+        index.track_forwarded(2, job)
+        wheel.advance(time.monotonic() + 10)
+        assert expired == [(job, "sent"), (job, "forwarded")]
+        assert len(index) == 0 and index.stats()['jobs'] == 0
+
+    run(scenario())
+
+
+def test_answered_sent_message_does_not_expire():
+    async def scenario():
+        expired = []
+        wheel = TimerWheel(tick=1.0)
+        index = CorrelationIndex(wheel=wheel, ttl=5, on_expire=lambda job, kind: expired.append((job, kind)))
+        job = LinkJob("https://terabox.com/s/1joba", "", key="terabox:joba")
+        job.sent_to_downloader("dl")
+        index.track_sent(1, job)
+        assert index.match_downloader_reply(1, "dl") is job
+        job.file_received()
+        wheel.advance(time.monotonic() + 10)
+        # The file store wait is left to the stage timeouts, later files still match
+        assert expired == []
+        assert index.match_downloader_reply(1, "dl") is job
+        index.discard_job(job)
+        assert len(index) == 0
+
+    run(scenario())
+
+
+def test_failure_is_raised_by_wait_done():
+    async def scenario():
+        job = LinkJob("https://terabox.com/s/1joba", "", key="terabox:joba")
+        job.sent_to_downloader("dl")
+        job.fail("sent message expired unanswered", StageTimeout(job.state, 5))
+        try:
+            await job.wait_done(0)
+        except StageTimeout as e:
+            assert e.stage is JobState.SENT_TO_DOWNLOADER
+        else:
+            raise AssertionError("wait_done returned for a failed job")
+
+    run(scenario())
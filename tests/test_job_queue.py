@@ -0,0 +1,49 @@
+import asyncio
+
+from job_queue import SqliteJobQueue
+from storage import StateDB
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def open_process(path, worker_id):
+    """A queue on its own connection, the way a second bot process opens the shared file."""
+    return SqliteJobQueue(StateDB(str(path), batch_size=1), "links", worker_id=worker_id)
+
+
+def test_processes_on_one_file_never_get_the_same_item(tmp_path):
+    async def scenario():
+        path = tmp_path / "state.db"
+        # Both run with the same worker id, the claims still must not mix up
+        first, second = open_process(path, "host1"), open_process(path, "host1")
+        for n in range(20):
+            await first.put({'n': n})
+        taken = []
+        while True:
+            items = [queue.get_nowait() for queue in (first, second)]
+            items = [item for item in items if item]
+            if not items:
+                break
+            taken.extend(items)
+        assert sorted(payload['n'] for _, payload in taken) == list(range(20))
+        assert len({item_id for item_id, _ in taken}) == 20
+
+    run(scenario())
+
+
+def test_recover_releases_only_its_own_items(tmp_path):
+    async def scenario():
+        path = tmp_path / "state.db"
+        running, restarted = open_process(path, "host1:100"), open_process(path, "host1:200")
+        await running.put({'n': 0})
+        await running.put({'n': 1})
+        assert running.get_nowait()[1] == {'n': 0}
+        assert restarted.get_nowait()[1] == {'n': 1}
+        # A restart of the second process must not take the first one's item away
+        assert restarted.recover() == 1
+        assert restarted.get_nowait()[1] == {'n': 1}
+        assert restarted.get_nowait() is None
+
+    run(scenario())
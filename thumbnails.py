@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import io
+import logging
+import mmap
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from telethon.tl.types import (
+    Message,
+    PhotoCachedSize,
+    PhotoSize,
+    PhotoSizeProgressive,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def photo_size_bytes(size) -> Optional[int]:
+    """Byte size Telegram reports for a photo size, None if it does not say."""
+    if isinstance(size, PhotoSize):
+        return size.size
+    if isinstance(size, PhotoCachedSize):
+        return len(size.bytes)
+    if isinstance(size, PhotoSizeProgressive):
+        return max(size.sizes) if size.sizes else None
+    return None
+
+
+def pick_thumb(sizes: Optional[List], target_size: int, max_bytes: int):
+    """Pick the size to download as cover image.
+
+    Prefers the smallest size whose longer side reaches `target_size`, otherwise
+    the largest one available. Stripped and path sizes are only previews and
+    are never picked; sizes over `max_bytes` are skipped.
+    """
+    candidates = []
+    for size in sizes or ():
+        if not isinstance(size, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive)):
+            continue
+        nbytes = photo_size_bytes(size)
+        if nbytes is not None and nbytes > max_bytes:
+            continue
+        candidates.append((max(size.w, size.h), size))
+    if not candidates:
+        return None
+
+    candidates.sort(key=lambda c: c[0])
+    for side, size in candidates:
+        if side >= target_size:
+            return size
+    return candidates[-1][1]
+
+
+def thumb_sizes(message: Message) -> Optional[List]:
+    """Photo sizes or document thumbnails carried by `message`, if any."""
+    if message.photo:
+        return message.photo.sizes
+    if message.document:
+        return message.document.thumbs
+    return None
+
+
+async def download_thumbnail(message: Message, target_size: int, max_bytes: int) -> Optional[bytes]:
+    """Download only a cover image for `message`, never the full media.
+
+    Photos are fetched at the size closest to `target_size`, videos and other
+    documents only contribute their embedded thumbnail.
+    """
+    size = pick_thumb(thumb_sizes(message), target_size, max_bytes)
+    if size is None:
+        logger.info("Source message has no usable thumbnail")
+        return None
+
+    data = await message.download_media(bytes, thumb=size)
+    if data and len(data) > max_bytes:
+        logger.warning(f"Thumbnail of {len(data)} bytes exceeds the {max_bytes} byte cap, dropping it")
+        return None
+    return data
+
+
+class MappedThumbnail(io.RawIOBase):
+    """Read-only, seekable view of a spilled thumbnail backed by mmap."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.name = os.path.basename(path)
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._map[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._map)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._map.close()
+        super().close()
+
+
+class ThumbnailStore:
+    """Byte-bounded LRU/TTL cache of thumbnails keyed by content hash.
+
+    Entries past the memory budget or TTL are evicted oldest first. When
+    `cache_dir` is set, evicted entries are spilled there instead of being
+    dropped and read back through mmap; the directory has its own byte budget.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, cache_dir: Optional[str] = None,
+                 disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._disk: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def __contains__(self, key: str) -> bool:
+        self._expire()
+        return key in self._memory or key in self._disk
+
+    def __len__(self):
+        return len(self._memory) + len(self._disk)
+
+    @staticmethod
+    def key_for(data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    def put(self, data: bytes) -> str:
+        """Store `data` and return its key; identical images share one entry."""
+        key = self.key_for(data)
+        now = time.monotonic()
+        if key in self._memory:
+            self._memory[key] = (data, now + self.ttl)
+            self._memory.move_to_end(key)
+            return key
+
+        self._memory[key] = (data, now + self.ttl)
+        self.memory_bytes += len(data)
+        self._drop_disk(key)
+        self._expire(now)
+        while self.memory_bytes > self.max_bytes and len(self._memory) > 1:
+            old_key, (old_data, _) = self._memory.popitem(last=False)
+            self.memory_bytes -= len(old_data)
+            self._evict(old_key, old_data)
+        return key
+
+    def get(self, key: Optional[str]) -> Optional[bytes]:
+        """Thumbnail bytes for `key`, None once it was evicted."""
+        source = self.open(key)
+        if source is None:
+            return None
+        with source:
+            return source.read()
+
+    def open(self, key: Optional[str]) -> Optional[io.IOBase]:
+        """Readable file object for `key`, named so Telegram treats it as a photo."""
+        if not key:
+            return None
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._memory.get(key)
+        if entry:
+            self.hits += 1
+            self._memory[key] = (entry[0], now + self.ttl)
+            self._memory.move_to_end(key)
+            buffer = io.BytesIO(entry[0])
+            buffer.name = f"{key}.jpg"
+            return buffer
+        if key in self._disk:
+            self.hits += 1
+            size, _ = self._disk[key]
+            self._disk[key] = (size, now + self.ttl)
+            self._disk.move_to_end(key)
+            try:
+                return MappedThumbnail(self._path(key))
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading spilled thumbnail {key}: {e}")
+                self._drop_disk(key)
+        self.misses += 1
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'entries': len(self),
+            'memory_bytes': self.memory_bytes,
+            'disk_bytes': self.disk_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'spills': self.spills,
+        }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    def _evict(self, key: str, data: bytes):
+        if self.cache_dir and len(data) <= self.disk_max_bytes:
+            try:
+                with open(self._path(key), 'wb') as f:
+                    f.write(data)
+                self._disk[key] = (len(data), time.monotonic() + self.ttl)
+                self.disk_bytes += len(data)
+                self.spills += 1
+                while self.disk_bytes > self.disk_max_bytes:
+                    self._drop_disk(next(iter(self._disk)), evicted=True)
+                return
+            except OSError as e:
+                logger.error(f"Error spilling thumbnail {key} to disk: {e}")
+        self.evictions += 1
+
+    def _drop_disk(self, key: str, evicted: bool = False):
+        entry = self._disk.pop(key, None)
+        if entry is None:
+            return
+        self.disk_bytes -= entry[0]
+        if evicted:
+            self.evictions += 1
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def _expire(self, now: Optional[float] = None):
+        """Drop entries past their TTL; access order equals expiry order."""
+        now = time.monotonic() if now is None else now
+        while self._memory:
+            key, (data, expires_at) = next(iter(self._memory.items()))
+            if expires_at > now:
+                break
+            del self._memory[key]
+            self.memory_bytes -= len(data)
+            self.evictions += 1
+        while self._disk:
+            key, (_, expires_at) = next(iter(self._disk.items()))
+            if expires_at > now:
+                break
+            self._drop_disk(key, evicted=True)
+
+    def _load_disk_index(self):
+        """Pick up thumbnails spilled by a previous run, oldest first."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.jpg'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        now_wall, now = time.time(), time.monotonic()
+        for mtime, key, size in sorted(entries):
+            self._disk[key] = (size, now + self.ttl - (now_wall - mtime))
+            self.disk_bytes += size
+        self._expire(now)
+
+
+class UploadCache:
+    """Remembers what Telegram returned for an uploaded thumbnail, by content hash.
+
+    The first post of an image uploads it; every later post sharing the same
+    image reuses the stored photo instead of uploading the bytes again.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._media: "OrderedDict[str, object]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.hits = 0
+        self.uploads = 0
+
+    def __len__(self):
+        return len(self._media)
+
+    def get(self, key: str):
+        media = self._media.get(key)
+        if media is not None:
+            self._media.move_to_end(key)
+            self.hits += 1
+        return media
+
+    def put(self, key: str, media):
+        self._media[key] = media
+        self._media.move_to_end(key)
+        while len(self._media) > self.max_entries:
+            self._media.popitem(last=False)
+
+    def discard(self, key: str):
+        self._media.pop(key, None)
+
+    def lock(self, key: str) -> asyncio.Lock:
+        """Serialises the first upload of `key` so concurrent posts share it."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    def release(self, key: str):
+        lock = self._locks.get(key)
+        if lock is not None and not lock.locked():
+            del self._locks[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {'entries': len(self), 'hits': self.hits, 'uploads': self.uploads}
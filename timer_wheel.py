@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Hashed timing wheel for TTLs of many short-lived entries.
+
+    Time is cut into ticks of `tick` seconds and every entry is hashed into
+    the slot of its deadline tick, modulo `slots`. Scheduling and cancelling
+    are O(1). Each tick only looks at one slot, so expiring costs O(1) per
+    entry amortized as long as the wheel is not much smaller than the number
+    of ticks a TTL spans.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self.slots: List[Dict[Hashable, Tuple[int, Callable[[], Any]]]] = [{} for _ in range(slots)]
+        self._slot_of: Dict[Hashable, int] = {}
+        self._current = self._tick_at(time.monotonic())
+        self.expired = 0
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slot_of
+
+    def _tick_at(self, now: float) -> int:
+        return int(now / self.tick)
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], Any]):
+        """Call `callback` in about `delay` seconds; replaces an earlier timer of `key`."""
+        self.cancel(key)
+        deadline = max(self._tick_at(time.monotonic() + delay), self._current + 1)
+        index = deadline % len(self.slots)
+        self.slots[index][key] = (deadline, callback)
+        self._slot_of[key] = index
+
+    def cancel(self, key: Hashable) -> bool:
+        index = self._slot_of.pop(key, None)
+        if index is None:
+            return False
+        del self.slots[index][key]
+        return True
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """Fire every timer due by `now`; returns how many fired."""
+        target = self._tick_at(time.monotonic() if now is None else now)
+        fired = 0
+        # After a long stall every slot is visited once, not once per missed tick
+        first = max(self._current + 1, target - len(self.slots) + 1)
+        for tick in range(first, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            due = [key for key, (deadline, _) in slot.items() if deadline <= target]
+            for key in due:
+                _, callback = slot.pop(key)
+                del self._slot_of[key]
+                fired += 1
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in expiry callback of {key}: {e}")
+        self._current = max(self._current, target)
+        self.expired += fired
+        return fired
+
+    async def run(self):
+        """Advance the wheel once per tick, forever."""
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+    def stats(self) -> Dict[str, int]:
+        return {'live': len(self), 'expired': self.expired}
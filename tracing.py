@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+
+def new_trace_id() -> str:
+    return os.urandom(8).hex()
+
+
+class LatencyHistogram:
+    """HDR-style histogram of durations with a fixed relative precision.
+
+    Durations are counted in whole `unit`s. Values below 2**`sub_bucket_bits`
+    units get a bucket each; above that every power of two is split into
+    2**(`sub_bucket_bits` - 1) equal buckets, so a bucket is never wider than
+    1/2**(`sub_bucket_bits` - 1) of the values it holds. Recording is O(1)
+    and memory grows with the log of the largest value, not the sample count.
+    """
+
+    def __init__(self, unit: float = 0.001, sub_bucket_bits: int = 7):
+        self.unit = unit
+        self.sub_bucket_bits = sub_bucket_bits
+        self._half = 1 << (sub_bucket_bits - 1)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def _index(self, value: int) -> int:
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return shift * self._half + (value >> shift)
+
+    def _highest_in(self, index: int) -> int:
+        if index < 2 * self._half:
+            return index
+        shift = index // self._half - 1
+        sub = index - shift * self._half
+        return ((sub + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        seconds = max(0.0, seconds)
+        index = self._index(int(seconds / self.unit))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Upper edge of the bucket holding `percentile` (0-100), None when empty."""
+        if not self.count:
+            return None
+        rank = max(1, round(percentile / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.max, (self._highest_in(index) + 1) * self.unit)
+        return self.max
+
+    def stats(self, percentiles: Iterable[float] = (50, 90, 99)) -> dict:
+        stats = {'count': self.count}
+        for percentile in percentiles:
+            value = self.percentile(percentile)
+            stats[f'p{percentile:g}'] = round(value, 3) if value is not None else None
+        stats['max'] = round(self.max, 3) if self.max is not None else None
+        return stats
+
+
+class Span:
+    """Times one stage of a trace; use with `with`."""
+
+    def __init__(self, tracer: "Tracer", trace_id: Optional[str], stage: str, attrs: dict):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.stage = stage
+        self.attrs = attrs
+
+    def __enter__(self) -> "Span":
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer.record(self.trace_id, self.stage, time.monotonic() - self._started, **self.attrs)
+        return False
+
+
+class Tracer:
+    """Per-stage latency histograms, plus an optional JSON lines file of every span.
+
+    A trace id names one link from the source message to the destination
+    post. Spans recorded without one, e.g. for work shared by several links,
+    only count towards the histograms and are exported with a null trace id.
+    """
+
+    def __init__(self, export_path: Optional[str] = None):
+        self.export_path = export_path
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._export: Optional[TextIO] = None
+
+    def span(self, trace_id: Optional[str], stage: str, **attrs) -> Span:
+        return Span(self, trace_id, stage, attrs)
+
+    def record(self, trace_id: Optional[str], stage: str, seconds: float, **attrs):
+        """Record that `stage` of `trace_id` took `seconds`, ending now."""
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = LatencyHistogram()
+        histogram.record(seconds)
+        if self.export_path:
+            self._write({
+                'trace_id': trace_id, 'stage': stage,
+                'start': round(time.time() - seconds, 6), 'duration': round(seconds, 6), **attrs,
+            })
+
+    def _write(self, span: dict):
+        try:
+            if self._export is None:
+                # Line buffered, so a crash loses at most the span being written
+                self._export = open(self.export_path, "a", buffering=1, encoding="utf-8")
+            self._export.write(json.dumps(span, default=str) + "\n")
+        except OSError as e:
+            logger.error(f"Error exporting span to {self.export_path}: {e}")
+            self.export_path = None
+
+    def stats(self) -> Dict[str, dict]:
+        return {stage: histogram.stats() for stage, histogram in self.histograms.items()}
+
+    def close(self):
+        if self._export is not None:
+            self._export.close()
+            self._export = None